@@ -1,46 +1,391 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Tuple
+from app.core.config import settings
 from app.services.image_service import ImageService
+from app.services.ingest import IngestWorker
+from app.services.job_queue import JobManager, DONE, FAILED
+from app.utils.encoding import ENCODE_OPTION_KEYS, save_options
+from app.utils.executor import ExecutorBusyError
+from app.utils.limits import ImageTooLargeError
 
 router = APIRouter()
 image_service = ImageService()
+job_manager = JobManager(image_service)
+ingest_worker = IngestWorker(image_service)
 
-class Base64Request(BaseModel):
+SegmentationEngine = Literal["remote", "local", "auto"]
+
+class OutputOptions(BaseModel):
+    """Output encoding options shared by the processing routes"""
+    output_format: Optional[Literal["png", "jpeg", "jpg", "webp", "avif"]] = None
+    preset: Optional[Literal["default", "fast", "small"]] = None
+    quality: Optional[int] = Field(None, ge=1, le=100)
+    compress_level: Optional[int] = Field(None, ge=0, le=9)
+    subsampling: Optional[Literal["4:4:4", "4:2:2", "4:2:0"]] = None
+    progressive: Optional[bool] = None
+    optimize: Optional[bool] = None
+    max_size: Optional[int] = Field(None, gt=0)
+
+class Base64Request(OutputOptions):
     image_base64: str
     bg_color: Optional[List[int]] = [255, 255, 255]
     aspect_ratio: Optional[List[int]] = [9, 16]
+    persist_outputs: Optional[bool] = False
+    segmentation_engine: Optional[SegmentationEngine] = None
 
-class PathRequest(BaseModel):
+class PathRequest(OutputOptions):
     input_image: str
     bg_color: Optional[List[int]] = [255, 255, 255]
     output_image: Optional[str] = None
+    aspect_ratio: Optional[List[int]] = [9, 16]
+    segmentation_engine: Optional[SegmentationEngine] = None
+
+class VariantSpec(OutputOptions):
+    bg_color: Optional[List[int]] = [255, 255, 255]
+    aspect_ratio: Optional[List[int]] = None
+    sharpen_method: Optional[Literal["sharpen", "unsharp"]] = None
+
+class VariantsRequest(BaseModel):
+    image_base64: str
+    variants: List[VariantSpec]
+    segmentation_engine: Optional[SegmentationEngine] = None
+
+class BatchRequest(BaseModel):
+    inputs: Optional[List[str]] = None
+    input_dir: Optional[str] = None
+    bg_color: Optional[List[int]] = [255, 255, 255]
+    aspect_ratio: Optional[List[int]] = [9, 16]
+    concurrency: Optional[int] = Field(None, gt=0, le=settings.MAX_BATCH_CONCURRENCY)
+
+OUTPUT_MEDIA_TYPES = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif")
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _parse_int_list(value: Optional[str], name: str) -> Optional[List[int]]:
+    """Parse a comma separated query value such as 255,255,255"""
+    if not value:
+        return None
+    try:
+        return [int(part) for part in value.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid {name}: {value}")
+
+def _iter_chunks(data: bytes):
+    view = memoryview(data)
+    for start in range(0, len(view), STREAM_CHUNK_SIZE):
+        yield view[start:start + STREAM_CHUNK_SIZE]
+
+def _output_params(options: OutputOptions, default_format: Optional[str] = "png") -> Tuple[Optional[str], dict]:
+    """
+    Validate output options.
+
+    Returns:
+        Tuple of (Pillow format name or None, encode options dict)
+    """
+    name = options.output_format or default_format
+    pil_format = OUTPUT_MEDIA_TYPES[name][0] if name else None
+    encode_options = {key: getattr(options, key) for key in ENCODE_OPTION_KEYS}
+    if pil_format:
+        try:
+            save_options(pil_format, **encode_options)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return pil_format, encode_options
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value covers etag"""
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+async def _process_binary(
+    image_bytes: bytes,
+    bg_color: str,
+    aspect_ratio: Optional[str],
+    options: OutputOptions,
+    if_none_match: Optional[str],
+    segmentation_engine: Optional[str] = None
+):
+    pil_format, encode_options = _output_params(options)
+    media_type = OUTPUT_MEDIA_TYPES[options.output_format or "png"][1]
+    variant = {
+        "background_color": _parse_int_list(bg_color, "bg_color"),
+        "aspect_ratio": _parse_int_list(aspect_ratio, "aspect_ratio"),
+        "output_format": pil_format,
+        "encode_options": encode_options,
+        "max_size": options.max_size
+    }
+    # The ETag is derived from the input and parameters, so a match needs no work at all
+    key = await asyncio.to_thread(image_service.output_key, image_bytes, variant, segmentation_engine)
+    etag = f'"{key}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        _, processed_bytes, _, _ = await image_service.render_output(image_bytes, variant, key, segmentation_engine)
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        _iter_chunks(processed_bytes),
+        media_type=media_type,
+        headers={"Content-Length": str(len(processed_bytes)), "ETag": etag}
+    )
+
+def _variant_params(request: VariantsRequest) -> List[dict]:
+    """Validate variant specs and convert them to render_variants dicts"""
+    if not request.variants:
+        raise HTTPException(status_code=422, detail="At least one variant is required")
+    if len(request.variants) > settings.MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"At most {settings.MAX_VARIANTS} variants per request")
+    params = []
+    for variant in request.variants:
+        output_format, encode_options = _output_params(variant)
+        params.append({
+            "background_color": variant.bg_color,
+            "aspect_ratio": variant.aspect_ratio,
+            "sharpen_method": variant.sharpen_method,
+            "output_format": output_format,
+            "encode_options": encode_options,
+            "max_size": variant.max_size
+        })
+    return params
 
 @router.get("/hello")
 async def say_hello():
     return {"message": "Hello from FastAPI"}
 
+@router.get("/cache/stats")
+async def cache_stats():
+    cache = image_service.segmentation_service.cache
+    output_cache = image_service.output_cache
+    stats = {"enabled": True, **cache.stats()} if cache is not None else {"enabled": False}
+    stats["output"] = {"enabled": True, **output_cache.stats()} if output_cache is not None else {"enabled": False}
+    stats["output"]["coalesced"] = image_service.inflight.coalesced
+    return stats
+
+@router.get("/segmentation/backends")
+async def segmentation_backends():
+    pool = image_service.segmentation_service.pool
+    return {"strategy": pool.strategy, "hedge_delay": pool.hedge_delay(), "backends": pool.snapshot()}
+
+@router.get("/admission")
+async def admission_status():
+    """Current in-use capacity and queue depth per admission-controlled resource"""
+    return image_service.admission.snapshot()
+
+@router.get("/ingest/status")
+async def ingest_status():
+    if not settings.INGEST_ENABLED:
+        return {"enabled": False}
+    return await ingest_worker.status()
+
+@router.post("/ingest/scan")
+async def ingest_scan():
+    """Scan INPUT_DIR now instead of waiting for the next interval"""
+    if not settings.INGEST_ENABLED:
+        raise HTTPException(status_code=409, detail="Ingest is disabled")
+    return {"queued": await ingest_worker.scan()}
+
 @router.post("/process/base64")
-async def process_base64(request: Base64Request):
+async def process_base64(request: Base64Request, if_none_match: Optional[str] = Header(None)):
+    output_format, encode_options = _output_params(request)
+    variant = image_service.output_variant(
+        request.bg_color, request.aspect_ratio, output_format, encode_options, request.max_size
+    )
     try:
-        result = await image_service.process_base64_image(
-            image_base64=request.image_base64,
-            bg_color=request.bg_color,
-            aspect_ratio=request.aspect_ratio
+        image_bytes = await image_service.decode_base64_image(request.image_base64)
+        # As in _process_binary, a matching client is answered before any rendering,
+        # unless it asked for the outputs to be written, which a 304 would skip.
+        # The ETag identifies the rendered image; the body's "etag" holds the same value
+        key = await asyncio.to_thread(image_service.output_key, image_bytes, variant, request.segmentation_engine)
+        etag = f'"{key}"'
+        if not request.persist_outputs and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        result = await image_service.process_decoded_image(
+            image_bytes, variant, request.persist_outputs, request.segmentation_engine, key
         )
-        return result
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(result, headers={"ETag": etag})
 
 @router.post("/process/path")
 async def process_path(request: PathRequest):
+    output_format, encode_options = _output_params(request, default_format=None)
     try:
         print(f"request: {request}")
         result = await image_service.process_path_image(
             input_image=request.input_image,
             bg_color=request.bg_color,
-            output_image=request.output_image
+            output_image=request.output_image,
+            aspect_ratio=request.aspect_ratio,
+            output_format=output_format,
+            encode_options=encode_options,
+            max_size=request.max_size,
+            segmentation_engine=request.segmentation_engine
         )
         return result
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/process/variants")
+async def process_variants(request: VariantsRequest):
+    """Render several backgrounds/aspect ratios/formats from one segmentation"""
+    variants = _variant_params(request)
+    try:
+        return await image_service.process_base64_variants(
+            request.image_base64, variants, request.segmentation_engine
+        )
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/process/batch")
+async def process_batch(request: BatchRequest):
+    """Stream one NDJSON line per finished item"""
+    try:
+        results = image_service.iter_batch(
+            inputs=request.inputs,
+            input_dir=request.input_dir,
+            bg_color=request.bg_color,
+            aspect_ratio=request.aspect_ratio,
+            concurrency=request.concurrency
+        )
+        first = await results.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def stream():
+        if first is not None:
+            yield json.dumps(first) + "\n"
+        async for result in results:
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _job_status(job: dict) -> dict:
+    return {key: job[key] for key in ("id", "kind", "status", "error", "created_at", "updated_at")}
+
+@router.post("/jobs/process/base64", status_code=202)
+async def submit_base64_job(request: Base64Request):
+    output_format, encode_options = _output_params(request)
+    job_id = await job_manager.submit("base64", {
+        "image_base64": request.image_base64,
+        "bg_color": request.bg_color,
+        "aspect_ratio": request.aspect_ratio,
+        "persist_outputs": request.persist_outputs,
+        "output_format": output_format,
+        "encode_options": encode_options,
+        "max_size": request.max_size,
+        "segmentation_engine": request.segmentation_engine
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+@router.post("/jobs/process/path", status_code=202)
+async def submit_path_job(request: PathRequest):
+    output_format, encode_options = _output_params(request, default_format=None)
+    job_id = await job_manager.submit("path", {
+        "input_image": request.input_image,
+        "bg_color": request.bg_color,
+        "output_image": request.output_image,
+        "aspect_ratio": request.aspect_ratio,
+        "output_format": output_format,
+        "encode_options": encode_options,
+        "max_size": request.max_size,
+        "segmentation_engine": request.segmentation_engine
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+@router.post("/jobs/process/variants", status_code=202)
+async def submit_variants_job(request: VariantsRequest):
+    job_id = await job_manager.submit("variants", {
+        "image_base64": request.image_base64,
+        "variants": _variant_params(request),
+        "segmentation_engine": request.segmentation_engine
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return _job_status(job)
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job["result"]
+
+@router.post("/process/upload")
+async def process_upload(
+    file: UploadFile = File(...),
+    bg_color: str = "255,255,255",
+    aspect_ratio: Optional[str] = "9,16",
+    segmentation_engine: Optional[SegmentationEngine] = None,
+    options: OutputOptions = Depends(),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Process a multipart upload and stream back the binary image"""
+    if file.size is not None and file.size > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Uploaded file too large")
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > settings.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Uploaded file too large")
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return await _process_binary(buffer, bg_color, aspect_ratio, options, if_none_match, segmentation_engine)
+
+@router.post("/process/raw")
+async def process_raw(
+    request: Request,
+    bg_color: str = "255,255,255",
+    aspect_ratio: Optional[str] = "9,16",
+    segmentation_engine: Optional[SegmentationEngine] = None,
+    options: OutputOptions = Depends(),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Process a raw image request body and stream back the binary image"""
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+        if len(buffer) > settings.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Request body too large")
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    return await _process_binary(buffer, bg_color, aspect_ratio, options, if_none_match, segmentation_engine)
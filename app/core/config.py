@@ -1,5 +1,6 @@
+import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 # evn dev live 
 ENV = "dev"
@@ -20,6 +21,115 @@ class Settings(BaseSettings):
         # File paths
         OUTPUT_DIR: str = "x://sso/segment_images/output-images"
         INPUT_DIR: str = "x://sso/segment_images/input-images"
+
+    # Binary uploads
+    MAX_UPLOAD_BYTES: int = 64 * 1024 * 1024
+
+    # Segmentation HTTP client
+    SEGMENTATION_CONNECT_TIMEOUT: float = 10.0
+    SEGMENTATION_POOL_SIZE: int = 100
+    SEGMENTATION_POOL_PER_HOST: int = 32
+    SEGMENTATION_KEEPALIVE_TIMEOUT: float = 30.0
+
+    # Start-up warm-up; /ready answers 503 until it has finished
+    WARM_UP_ENABLED: bool = True
+    SEGMENTATION_WARMUP_CONNECTIONS: int = 2  # pooled connections opened per backend
+
+    # Segmentation backends; SEGMENTATION_API_URL is used when the list is empty
+    SEGMENTATION_API_URLS: List[str] = []
+    SEGMENTATION_BALANCER: str = "least_outstanding"  # or "latency_weighted"
+    SEGMENTATION_MAX_ATTEMPTS: int = 2
+    SEGMENTATION_HEALTH_PATH: str = "/health"
+    SEGMENTATION_HEALTH_INTERVAL: float = 10.0  # 0 disables active checks
+    SEGMENTATION_HEALTH_TIMEOUT: float = 2.0
+    SEGMENTATION_CIRCUIT_FAILURES: int = 3
+    SEGMENTATION_CIRCUIT_COOLDOWN: float = 30.0
+    SEGMENTATION_HEDGE_PERCENTILE: float = 95.0  # 0 disables hedged requests
+    SEGMENTATION_HEDGE_MIN_SAMPLES: int = 20
+
+    # Send a reduced copy to the backend and upscale the mask (0 sends the original)
+    SEGMENTATION_MAX_SIDE: int = 0
+    SEGMENTATION_DOWNSCALE_QUALITY: int = 90
+    SEGMENTATION_MASK_REFINE: bool = True
+
+    # Segmentation engine: "remote" (backend API), "local" (in-process, for
+    # near-uniform backdrops) or "auto" (local when the backdrop looks uniform)
+    SEGMENTATION_ENGINE: str = "remote"
+    LOCAL_SEGMENTATION_TOLERANCE: float = 24.0  # RGB distance from the backdrop color
+    LOCAL_SEGMENTATION_MIN_CONFIDENCE: float = 0.9  # share of border pixels matching the backdrop
+    LOCAL_SEGMENTATION_FEATHER: float = 1.0  # mask edge blur radius in pixels
+    LOCAL_SEGMENTATION_WORK_SIDE: int = 1024  # the mask is computed at this size and upscaled
+
+    # Segmentation result cache
+    SEGMENTATION_CACHE_ENABLED: bool = True
+    SEGMENTATION_CACHE_MEMORY_BYTES: int = 256 * 1024 * 1024
+    SEGMENTATION_CACHE_DISK_ENABLED: bool = False
+    SEGMENTATION_CACHE_DISK_BYTES: int = 2 * 1024 * 1024 * 1024
+    SEGMENTATION_CACHE_DIR: str = "segmentation-cache"  # relative to OUTPUT_DIR
+
+    # Encoded output cache, also the source of response ETags
+    OUTPUT_CACHE_ENABLED: bool = True
+    OUTPUT_CACHE_MEMORY_BYTES: int = 256 * 1024 * 1024
+
+    # Compositing engine ("pillow" or "numpy")
+    COMPOSITE_ENGINE: str = "pillow"
+
+    # Compositing executor ("thread" or "process")
+    COMPOSITE_EXECUTOR: str = "thread"
+    COMPOSITE_WORKERS: int = os.cpu_count() or 1
+    COMPOSITE_QUEUE_SIZE: int = 32
+
+    # Size limits, checked from the image header before any decoding
+    MAX_INPUT_PIXELS: int = 100_000_000
+    MAX_CANVAS_PIXELS: int = 400_000_000
+    RENDER_MEMORY_BUDGET_BYTES: int = 1024 * 1024 * 1024
+    # Canvases at least this large are composited in strips of TILE_ROWS rows.
+    # Only PNG output is streamed strip by strip; JPEG/WebP/AVIF still
+    # assemble a full RGB canvas, which RENDER_MEMORY_BUDGET_BYTES accounts for
+    TILED_COMPOSITE_PIXELS: int = 40_000_000
+    TILE_ROWS: int = 256
+    # Outputs shrunk by max_size decode JPEG inputs at 1/2, 1/4 or 1/8 scale
+    # (DCT scaling) when that still covers every requested output
+    REDUCED_DECODE_ENABLED: bool = True
+
+    # Admission control; requests wait up to ADMISSION_QUEUE_TIMEOUT seconds
+    # in per-client fair queues before being rejected with 429/503
+    ADMISSION_SEGMENTATION_LIMIT: int = 32  # in-flight segmentation backend calls
+    ADMISSION_COMPOSITING_LIMIT: int = 0  # in-flight compositing jobs, 0 uses COMPOSITE_WORKERS
+    ADMISSION_MEMORY_BYTES: int = 2 * 1024 * 1024 * 1024  # estimated bytes held by requests in progress
+    ADMISSION_QUEUE_SIZE: int = 256
+    ADMISSION_CLIENT_QUEUE_SIZE: int = 32
+    ADMISSION_QUEUE_TIMEOUT: float = 10.0
+    ADMISSION_CLIENT_HEADER: str = "X-Client-ID"  # falls back to the client address
+    # Batch items, async jobs and ingest wait for capacity instead of being
+    # rejected, retrying for up to BUSY_RETRY_TIMEOUT seconds
+    BUSY_RETRY_TIMEOUT: float = 300.0
+
+    # Multi-variant rendering
+    MAX_VARIANTS: int = 16
+
+    # Batch processing
+    BATCH_CONCURRENCY: int = 8
+    MAX_BATCH_CONCURRENCY: int = 64
+
+    # Asynchronous jobs ("memory" or "sqlite")
+    JOB_QUEUE_BACKEND: str = "memory"
+    JOB_SQLITE_PATH: str = "jobs.db"
+    JOB_WORKERS: int = 4
+    JOB_RESULT_TTL: int = 3600
+
+    # INPUT_DIR ingest worker
+    INGEST_ENABLED: bool = False
+    INGEST_WORKERS: int = 2
+    INGEST_SCAN_INTERVAL: float = 5.0
+    INGEST_SETTLE_SECONDS: float = 2.0  # skip files modified more recently than this
+    INGEST_MANIFEST_PATH: str = "ingest-manifest.db"
+    INGEST_BG_COLOR: List[int] = [255, 255, 255]
+    INGEST_ASPECT_RATIO: List[int] = [9, 16]
+    INGEST_OUTPUT_FORMAT: str = "JPEG"
+    INGEST_MAX_ATTEMPTS: int = 5  # tries for a file failing with a transient error
+    INGEST_RETRY_BACKOFF: float = 30.0  # seconds before the first retry, doubled for each further one
+
     # Logging
     LOG_LEVEL: str = "INFO"
 
@@ -0,0 +1,194 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """Monotonic counter, optionally read from a callback instead of inc()"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        if self.callback is not None:
+            yield self.name, "", self.callback()
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(key), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed upper bounds"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            # [count per bucket ..., +Inf count, sum]
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(key, ("le", _format_value(float(bound)))), cumulative
+            yield f"{self.name}_count", _format_labels(key), cumulative
+            yield f"{self.name}_sum", _format_labels(key), state[-1]
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, documentation, callback))
+
+    def gauge(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("imageservice_stage_duration_seconds", "Time spent in each pipeline stage")
+REQUEST_SECONDS = registry.histogram("imageservice_request_duration_seconds", "HTTP request duration")
+REQUESTS = registry.counter("imageservice_requests_total", "HTTP requests by route and status")
+IN_FLIGHT = registry.gauge("imageservice_requests_in_flight", "HTTP requests currently being handled")
+BYTES_IN = registry.counter("imageservice_image_bytes_in_total", "Encoded input image bytes received")
+BYTES_OUT = registry.counter("imageservice_image_bytes_out_total", "Encoded output image bytes produced")
+BACKEND_ERRORS = registry.counter("imageservice_segmentation_errors_total", "Failed segmentation backend calls")
+HEDGED_REQUESTS = registry.counter("imageservice_segmentation_hedged_total", "Hedged segmentation requests sent")
+SEGMENTATIONS = registry.counter("imageservice_segmentations_total", "Segmentations computed, by engine (local or remote)")
+ADMISSION_REJECTED = registry.counter("imageservice_admission_rejected_total", "Requests rejected by admission control")
+
+# Per-request list of (stage, seconds); set by the HTTP middleware
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> List[Tuple[str, float]]:
+    """Begin collecting stage timings for the current request context"""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def observe_stage(stage: str, duration: float) -> None:
+    """
+    Record a stage duration measured elsewhere (e.g. in a worker process).
+
+    The duration goes into the stage histogram and, inside an HTTP request,
+    into that request's Server-Timing header.
+    """
+    STAGE_SECONDS.observe(duration, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, duration))
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage, see observe_stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """Format timings as a Server-Timing header value (durations in ms)"""
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in timings)
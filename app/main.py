@@ -1,7 +1,16 @@
 # main.py
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import router as image_router
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.core.metrics import (
+    registry, start_request_timings, server_timing_header,
+    IN_FLIGHT, REQUESTS, REQUEST_SECONDS
+)
+from app.core.config import settings
+from app.api.routes import router as image_router, image_service, job_manager, ingest_worker
+from app.utils.admission import set_client
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi import applications
 
@@ -15,7 +24,21 @@ def swagger_monkey_patch(*args, **kwargs):
 
 applications.get_swagger_ui_html = swagger_monkey_patch
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 构建分割客户端、启动后端健康检查，并在后台预热（见 /ready）
+    await image_service.start()
+    await job_manager.start()
+    if settings.INGEST_ENABLED:
+        await ingest_worker.start()
+    yield
+    if settings.INGEST_ENABLED:
+        await ingest_worker.stop()
+    await job_manager.stop()
+    # 关闭分割服务的连接池
+    await image_service.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # 添加 CORS 中间件配置
 app.add_middleware(
@@ -26,8 +49,81 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头部
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    # 记录请求耗时与各阶段耗时，并通过 Server-Timing 头返回
+    timings = start_request_timings()
+    # 按客户端公平排队（见 AdmissionController）
+    client = request.headers.get(settings.ADMISSION_CLIENT_HEADER)
+    set_client(client or (request.client.host if request.client else "unknown"))
+    IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        duration = time.perf_counter() - start
+        IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(duration, route=path)
+        REQUESTS.inc(route=path, status=str(status))
+    timings.append(("total", duration))
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 app.include_router(image_router, prefix="/api")
 
+def _cache_stat(name: str):
+    def value():
+        # Scraping /metrics must not build the lazily created service
+        if "segmentation_service" not in image_service.__dict__:
+            return 0
+        cache = image_service.segmentation_service.cache
+        return cache.stats().get(name, 0) if cache is not None else 0
+    return value
+
+registry.gauge("imageservice_compositing_pending", "Compositing jobs running or queued",
+               callback=lambda: image_service.executor.pending)
+registry.counter("imageservice_segmentation_cache_hits_total", "Segmentation cache hits",
+                 callback=_cache_stat("hits"))
+registry.counter("imageservice_segmentation_cache_misses_total", "Segmentation cache misses",
+                 callback=_cache_stat("misses"))
+registry.gauge("imageservice_segmentation_cache_memory_bytes", "Bytes held by the in-memory segmentation cache",
+               callback=_cache_stat("memory_bytes"))
+registry.counter("imageservice_output_cache_hits_total", "Output cache hits",
+                 callback=lambda: image_service.output_cache.hits if image_service.output_cache is not None else 0)
+registry.counter("imageservice_output_cache_misses_total", "Output cache misses",
+                 callback=lambda: image_service.output_cache.misses if image_service.output_cache is not None else 0)
+registry.gauge("imageservice_ingest_backlog", "INPUT_DIR files queued or being processed",
+               callback=lambda: ingest_worker.backlog)
+registry.counter("imageservice_ingest_processed_total", "INPUT_DIR files processed",
+                 callback=lambda: ingest_worker.processed)
+registry.counter("imageservice_ingest_failed_total", "INPUT_DIR files that failed to process",
+                 callback=lambda: ingest_worker.failed)
+registry.counter("imageservice_coalesced_requests_total", "Requests that joined an identical in-flight computation",
+                 callback=lambda: image_service.inflight.coalesced)
+
+for _limiter in image_service.admission.limiters:
+    registry.gauge(f"imageservice_admission_{_limiter.name}_in_use",
+                   f"Admitted {_limiter.name} capacity in use",
+                   callback=lambda limiter=_limiter: limiter.in_use)
+    registry.gauge(f"imageservice_admission_{_limiter.name}_waiting",
+                   f"Requests waiting for {_limiter.name} capacity",
+                   callback=lambda limiter=_limiter: limiter.waiting)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def ready():
+    # 就绪探针：启动预热完成前返回 503
+    if not image_service.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True, "warm_up_seconds": image_service.warm_up_seconds}
+
 @app.get("/hello")
 def hello():
     return {"message": "Hello, world"}
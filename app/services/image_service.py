@@ -1,108 +1,566 @@
 
 import os
-import base64
-import tempfile
-from PIL import Image
-from io import BytesIO
+import time
+import asyncio
+import logging
+from functools import cached_property
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple
 from app.core.config import settings
+from app.core.metrics import span, observe_stage, BYTES_IN, BYTES_OUT
 
-# Import custom modules
-from app.utils.segment import SegmentationService
-from app.utils.background import BackgroundProcessor
+# Import custom modules; app.utils.segment (aiohttp) and app.utils.background
+# (NumPy) are imported on first use to keep worker start-up fast
+from app.utils.admission import AdmissionController
+from app.utils.alpha_mask import MASK_EXTENSION
+from app.utils.base64_stream import decode_base64, encode_data_url
+from app.utils.cache import OutputCache, SegmentationCache, SingleFlight
+from app.utils.encoding import EXTENSIONS, MIME_TYPES
+from app.utils.executor import CompositingExecutor, retry_when_busy
+from app.utils.limits import check_render_budget, probe_image
+
+if TYPE_CHECKING:
+    from app.utils.background import BackgroundProcessor
+    from app.utils.segment import SegmentationService
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+logger = logging.getLogger(__name__)
 
 class ImageService:
+    """
+    Image processing pipeline.
+
+    Construction is cheap: the segmentation client and background
+    processor are built on first use, and start() (called from the FastAPI
+    lifespan) builds them up front and warms them up in the background.
+    ``ready`` turns true once warm-up has finished.
+    """
+
     def __init__(self):
         self.OUTPUT_DIR = settings.OUTPUT_DIR
+        self.admission = AdmissionController.from_settings()
+        self.executor = CompositingExecutor.from_settings()
+        self.output_cache = OutputCache(settings.OUTPUT_CACHE_MEMORY_BYTES) if settings.OUTPUT_CACHE_ENABLED else None
+        self.inflight = SingleFlight()
+        self.ready = False
+        self.warm_up_seconds: Optional[float] = None
+        self._warm_up_task: Optional[asyncio.Task] = None
+
+    @cached_property
+    def segmentation_service(self) -> "SegmentationService":
+        from app.utils.segment import SegmentationService
+        return SegmentationService(limiter=self.admission.segmentation)
+
+    @cached_property
+    def background_processor(self) -> "BackgroundProcessor":
+        from app.utils.background import BackgroundProcessor
+        return BackgroundProcessor()
+
+    async def start(self):
         os.makedirs(self.OUTPUT_DIR, exist_ok=True)
-        self.segmentation_service = SegmentationService()
-        self.background_processor = BackgroundProcessor()
+        await self.segmentation_service.start()
+        if settings.WARM_UP_ENABLED:
+            self._warm_up_task = asyncio.create_task(self.warm_up())
+        else:
+            self.ready = True
+
+    async def warm_up(self):
+        """
+        Pay one-off start-up costs before the first request.
 
-    async def process_base64_image(self, image_base64: str, bg_color: list = [255, 255, 255], aspect_ratio: list = [9, 16]):
+        Opens pooled connections to every segmentation backend and runs a
+        tiny render in each compositing worker, which imports the
+        compositing modules and loads Pillow's plugins and codecs there.
+        Failures are logged; the service is marked ready either way.
+        """
+        from app.utils.background import warm_up
+        start = time.perf_counter()
         try:
-            # 1. Process base64 string
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_base64)
-            
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-                temp_input_path = temp_file.name
-                temp_file.write(image_bytes)
-            
-            # 2. Call segmentation service
-            temp_output_name = f"temp_segmented_{os.path.basename(temp_input_path)}"
-            success, segmented_path = self.segmentation_service.segment_image(temp_input_path, temp_output_name)
-            
-            if not success:
-                os.unlink(temp_input_path)
-                raise Exception(f"Segmentation failed: {segmented_path}")
-            
-            # 3. Add background and adjust size
-            target_aspect_ratio = tuple(aspect_ratio) if aspect_ratio else None
-            final_output_path = os.path.join(self.OUTPUT_DIR, f"processed_{os.path.basename(temp_output_name)}")
-            
-            self.background_processor.add_background(
-                image_path=segmented_path,
-                background_color=tuple(bg_color),
-                output_path=final_output_path,
-                target_aspect_ratio=target_aspect_ratio
+            await asyncio.gather(
+                self.segmentation_service.warm_up(),
+                *(self.executor.run(warm_up) for _ in range(self.executor.max_workers))
             )
-            
-            # 4. Convert processed image to base64
-            with open(final_output_path, "rb") as f:
-                processed_bytes = f.read()
-            
-            output_b64 = base64.b64encode(processed_bytes).decode('utf-8')
-            
-            # 5. Cleanup
-            os.unlink(temp_input_path)
-            
-            return {
-                "result_base64": f"data:image/png;base64,{output_b64}",
-                "segmented_path": segmented_path,
-                "final_path": final_output_path
-            }
-            
         except Exception as e:
-            if 'temp_input_path' in locals() and os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            raise e
+            logger.warning(f"Warm-up failed: {str(e)}")
+        self.warm_up_seconds = time.perf_counter() - start
+        self.ready = True
+        logger.info(f"Warm-up finished in {self.warm_up_seconds:.2f}s")
+
+    async def close(self):
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+            self._warm_up_task = None
+        if "segmentation_service" in self.__dict__:
+            await self.segmentation_service.close()
+        self.executor.shutdown()
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def output_key(self, image_bytes: bytes, variant: Dict, segmentation_engine: Optional[str] = None) -> str:
+        """Output cache key, and strong ETag, for rendering ``variant`` from ``image_bytes``"""
+        params = dict(variant, output_format=(variant.get("output_format") or "PNG").upper())
+        # Settings that change the segmented image change the output too
+        params["segmentation_engine"] = segmentation_engine or settings.SEGMENTATION_ENGINE
+        params["segmentation_max_side"] = settings.SEGMENTATION_MAX_SIDE
+        params["segmentation_downscale_quality"] = settings.SEGMENTATION_DOWNSCALE_QUALITY
+        params["segmentation_mask_refine"] = settings.SEGMENTATION_MASK_REFINE
+        return OutputCache.key_for(image_bytes, params)
+
+    async def render_output(
+        self,
+        image_bytes: bytes,
+        variant: Dict,
+        key: Optional[str] = None,
+        segmentation_engine: Optional[str] = None
+    ) -> Tuple[Optional[bytes], bytes, float, str]:
+        """
+        Render one output, serving repeats from the output cache.
+
+        Identical requests in flight at the same time share a single
+        segmentation and compositing run.
+
+        Args:
+            image_bytes: Encoded input image
+            variant: Output spec, see BackgroundProcessor.render_variants
+            key: Precomputed output_key, if the caller already has it
+            segmentation_engine: See SegmentationService.segment_bytes
+
+        Returns:
+            Tuple of (segmentation AlphaMask bytes or None when served from the
+            cache, encoded output bytes, encode seconds, output key)
+        """
+        if key is None:
+            key = await asyncio.to_thread(self.output_key, image_bytes, variant, segmentation_engine)
+        if self.output_cache is not None:
+            with span("output_cache_lookup"):
+                cached = self.output_cache.get(key)
+            if cached is not None:
+                BYTES_IN.inc(len(image_bytes))
+                BYTES_OUT.inc(len(cached))
+                return None, cached, 0.0, key
 
-    async def process_path_image(self, input_image: str, bg_color: list = [255, 255, 255], output_image: str = None):
+        async def compute():
+            segmented, outputs = await self.process_image_variants(image_bytes, [variant], segmentation_engine)
+            data, encode_seconds = outputs[0]
+            if self.output_cache is not None:
+                self.output_cache.put(key, data)
+            return segmented, data, encode_seconds
+
+        (segmented, data, encode_seconds), _ = await self.inflight.run(key, compute)
+        return segmented, data, encode_seconds, key
+
+    async def process_image_bytes(
+        self,
+        image_bytes: bytes,
+        bg_color: list = [255, 255, 255],
+        aspect_ratio: list = [9, 16],
+        output_format: str = "PNG",
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None,
+        segmentation_engine: Optional[str] = None
+    ) -> Tuple[Optional[bytes], bytes]:
+        """
+        Segment encoded image bytes and composite them onto a background.
+
+        Returns:
+            Tuple of (segmentation AlphaMask bytes or None when served from the
+            output cache, encoded output image bytes)
+        """
+        segmented, data, _, _ = await self.render_output(image_bytes, {
+            "background_color": bg_color,
+            "aspect_ratio": aspect_ratio,
+            "output_format": output_format,
+            "encode_options": encode_options,
+            "max_size": max_size
+        }, segmentation_engine=segmentation_engine)
+        return segmented, data
+
+    async def process_image_variants(
+        self,
+        image_bytes: bytes,
+        variants: List[Dict],
+        segmentation_engine: Optional[str] = None
+    ) -> Tuple[bytes, List[Tuple[bytes, float]]]:
+        """
+        Segment encoded image bytes once and render every requested variant.
+
+        All variants are rendered by a single compositing job, which decodes
+        the original once and cuts it out with the segmentation mask. Each
+        variant's encode time is recorded as the "encode_output" stage.
+
+        Returns:
+            Tuple of (segmentation AlphaMask bytes, (encoded bytes, encode
+            seconds) per variant in the order of ``variants``)
+        """
+        BYTES_IN.inc(len(image_bytes))
+        # Reject oversized requests from the header, before decoding anything
+        with span("probe"):
+            image_size, image_format = await asyncio.to_thread(probe_image, image_bytes)
+        peak_bytes = check_render_budget(image_size, variants, image_format)
+
+        # Hold the input and the estimated decode/render memory until done
+        async with self.admission.memory.hold(len(image_bytes) + peak_bytes):
+            with span("segmentation"):
+                success, segmented = await self.segmentation_service.segment_bytes(image_bytes, segmentation_engine)
+            if not success:
+                raise Exception(f"Segmentation failed: {segmented}")
+
+            from app.utils.background import render_background_variants
+            with span("composite"):
+                outputs = await self._composite(render_background_variants, image_bytes, variants, segmented)
+        for data, encode_seconds in outputs:
+            observe_stage("encode_output", encode_seconds)
+            BYTES_OUT.inc(len(data))
+        return segmented, outputs
+
+    async def process_base64_variants(
+        self,
+        image_base64: str,
+        variants: List[Dict],
+        segmentation_engine: Optional[str] = None
+    ):
+        with span("decode"):
+            image_bytes = await asyncio.to_thread(decode_base64, image_base64)
+
+        _, outputs = await self.process_image_variants(image_bytes, variants, segmentation_engine)
+
+        results = []
+        with span("encode"):
+            for variant, (data, encode_seconds) in zip(variants, outputs):
+                output_format = (variant.get("output_format") or "PNG").upper()
+                results.append({
+                    "result_base64": await asyncio.to_thread(encode_data_url, data, MIME_TYPES[output_format]),
+                    "format": output_format,
+                    "size": len(data),
+                    "encode_ms": round(encode_seconds * 1000, 1)
+                })
+        return {"results": results}
+
+    @staticmethod
+    def output_variant(
+        bg_color: list = [255, 255, 255],
+        aspect_ratio: list = [9, 16],
+        output_format: str = "PNG",
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None
+    ) -> Dict:
+        """render_output spec for a single-output request"""
+        return {
+            "background_color": bg_color,
+            "aspect_ratio": aspect_ratio,
+            "output_format": output_format.upper(),
+            "encode_options": encode_options,
+            "max_size": max_size
+        }
+
+    async def decode_base64_image(self, image_base64: str) -> bytes:
+        """Decode a base64 image or data URL in chunks, without copying the payload"""
+        with span("decode"):
+            return await asyncio.to_thread(decode_base64, image_base64)
+
+    async def process_base64_image(
+        self,
+        image_base64: str,
+        bg_color: list = [255, 255, 255],
+        aspect_ratio: list = [9, 16],
+        persist_outputs: bool = False,
+        output_format: str = "PNG",
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None,
+        segmentation_engine: Optional[str] = None
+    ):
+        # 1. Process base64 string
+        image_bytes = await self.decode_base64_image(image_base64)
+        variant = self.output_variant(bg_color, aspect_ratio, output_format, encode_options, max_size)
+        return await self.process_decoded_image(image_bytes, variant, persist_outputs, segmentation_engine)
+
+    async def process_decoded_image(
+        self,
+        image_bytes: bytes,
+        variant: Dict,
+        persist_outputs: bool = False,
+        segmentation_engine: Optional[str] = None,
+        key: Optional[str] = None
+    ):
+        """
+        Render a decoded base64 request; see process_base64_image.
+
+        ``key`` is the precomputed output_key, for callers that compare
+        ETags before rendering.
+        """
+        # 2. Segment and add background, or reuse an identical earlier result
+        output_format = variant["output_format"]
+        segmented, processed_bytes, encode_seconds, key = await self.render_output(
+            image_bytes, variant, key, segmentation_engine
+        )
+        
+        # 3. Persist the segmentation mask and final image only on request;
+        #    names are content-addressed so repeated requests do not rewrite
+        #    them, and the mask is named after the input it belongs to
+        segmented_path = final_output_path = None
+        if persist_outputs:
+            source_digest = await asyncio.to_thread(SegmentationCache.key_for, image_bytes)
+            segmented_path = os.path.join(self.OUTPUT_DIR, f"segmented_{source_digest[:32]}{MASK_EXTENSION}")
+            final_output_path = os.path.join(self.OUTPUT_DIR, f"processed_{key[:32]}.{EXTENSIONS[output_format]}")
+            with span("persist"):
+                if not os.path.exists(segmented_path):
+                    if segmented is None:
+                        success, segmented = await self.segmentation_service.segment_bytes(
+                            image_bytes, segmentation_engine
+                        )
+                        if not success:
+                            raise Exception(f"Segmentation failed: {segmented}")
+                    await asyncio.to_thread(self._write_file, segmented_path, segmented)
+                if not os.path.exists(final_output_path):
+                    await asyncio.to_thread(self._write_file, final_output_path, processed_bytes)
+        
+        # 4. Convert processed image to base64
+        with span("encode"):
+            result_base64 = await asyncio.to_thread(encode_data_url, processed_bytes, MIME_TYPES[output_format])
+        
+        return {
+            "result_base64": result_base64,
+            "format": output_format,
+            "size": len(processed_bytes),
+            "encode_ms": round(encode_seconds * 1000, 1),
+            "etag": f'"{key}"',
+            "segmented_path": segmented_path,
+            "final_path": final_output_path
+        }
+
+    async def process_path_image(
+        self,
+        input_image: str,
+        bg_color: list = [255, 255, 255],
+        output_image: str = None,
+        aspect_ratio: list = [9, 16],
+        output_format: Optional[str] = None,
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None,
+        segmentation_engine: Optional[str] = None
+    ):
         if not os.path.exists(input_image):
             raise Exception(f"Invalid path: {input_image}")
         print(f"input_image: {input_image} , output_image: {output_image} , bg_color: {bg_color}")
+        memory = 0
         try:
-            # 1. Call segmentation service
-            temp_output_name = f"segmented_{os.path.basename(input_image)}"
+            # 0. Reject oversized inputs from the header
+            image_size, image_format = await asyncio.to_thread(probe_image, input_image)
+            peak_bytes = check_render_budget(image_size, [{
+                "aspect_ratio": aspect_ratio,
+                "max_size": max_size,
+                "output_format": output_format or "JPEG"
+            }], image_format)
+            memory = await self.admission.memory.acquire(os.path.getsize(input_image) + peak_bytes)
+
+            # 1. Call segmentation service; it saves the alpha mask only
+            name, _ = os.path.splitext(os.path.basename(input_image))
+            temp_output_name = f"segmented_{name}{MASK_EXTENSION}"
             print(f"query segmentation service temp_output_name: {temp_output_name}")
-            success, segmented_path = self.segmentation_service.segment_image(input_image, temp_output_name)
+            with span("segmentation"):
+                success, segmented_path = await self.segmentation_service.segment_image(
+                    input_image, temp_output_name, segmentation_engine
+                )
             
             if not success:
                 raise Exception(f"Segmentation failed: {segmented_path}")
             
-            # 2. Add background and adjust size
-            target_aspect_ratio = [9, 16]
+            # 2. Cut the original out with the mask, add background and adjust size
+            target_aspect_ratio = tuple(aspect_ratio) if aspect_ratio else None
             print(f"target_aspect_ratio: {target_aspect_ratio} , output_image: {output_image}")
             if not output_image:
                 name, _ = os.path.splitext(os.path.basename(input_image))
-                aspect_str = f"_9_16"
-                output_image = f"{name}_processed{aspect_str}.jpg"
+                aspect_str = f"_{aspect_ratio[0]}_{aspect_ratio[1]}" if aspect_ratio else ""
+                extension = EXTENSIONS[output_format.upper()] if output_format else "jpg"
+                output_image = f"{name}_processed{aspect_str}.{extension}"
             print(f"target_aspect_ratio: {target_aspect_ratio} , output_image: {output_image}")
 
             final_output_path = os.path.join(self.OUTPUT_DIR, output_image)
             print(f"final_output_path: {final_output_path}")
-            self.background_processor.add_background(
-                image_path=segmented_path,
-                background_color=tuple(bg_color),
-                output_path=final_output_path,
-                target_aspect_ratio=target_aspect_ratio
-            )
+            from app.utils.background import add_background_file
+            BYTES_IN.inc(os.path.getsize(input_image))
+            with span("composite"):
+                size, encode_seconds = await self._composite(
+                    add_background_file,
+                    image_path=input_image,
+                    mask_path=segmented_path,
+                    background_color=tuple(bg_color),
+                    output_path=final_output_path,
+                    target_aspect_ratio=target_aspect_ratio,
+                    encode_options=encode_options,
+                    max_size=max_size,
+                    output_format=output_format
+                )
+            observe_stage("encode_output", encode_seconds)
+            BYTES_OUT.inc(size)
             
             return {
                 "segmented_path": segmented_path,
-                "final_path": final_output_path
+                "final_path": final_output_path,
+                "size": size,
+                "encode_ms": round(encode_seconds * 1000, 1)
             }
             
         except Exception as e:
-            raise e
\ No newline at end of file
+            raise e
+        finally:
+            if memory:
+                self.admission.memory.release(memory)
+
+    def _resolve_batch_inputs(self, inputs: Optional[List[str]], input_dir: Optional[str]) -> List[str]:
+        """Expand batch inputs to a list of image paths"""
+        paths = list(inputs or [])
+        if input_dir is not None:
+            root = os.path.realpath(settings.INPUT_DIR)
+            directory = os.path.realpath(os.path.join(root, input_dir))
+            if os.path.commonpath([root, directory]) != root:
+                raise Exception(f"input_dir must be inside {settings.INPUT_DIR}: {input_dir}")
+            if not os.path.isdir(directory):
+                raise Exception(f"Invalid directory: {input_dir}")
+            paths.extend(
+                os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        if not paths:
+            raise Exception("No input images given")
+        return paths
+
+    async def _composite(self, fn, *args, **kwargs):
+        """Run a compositing job once admitted, see AdmissionController"""
+        async with self.admission.compositing.hold():
+            return await self.executor.run(fn, *args, **kwargs)
+
+    async def _run_compositing(self, fn, *args, **kwargs):
+        """Run a compositing job, waiting for capacity instead of failing"""
+        return await retry_when_busy(lambda: self._composite(fn, *args, **kwargs), settings.BUSY_RETRY_TIMEOUT)
+
+    async def iter_batch(
+        self,
+        inputs: Optional[List[str]] = None,
+        input_dir: Optional[str] = None,
+        bg_color: list = [255, 255, 255],
+        aspect_ratio: list = [9, 16],
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Process many images, yielding one result dict per item as it finishes.
+
+        Segmentation and compositing run as separate pipeline stages joined
+        by a bounded queue, so the segmentation call for one image overlaps
+        with compositing of the previous ones. ``concurrency`` caps the
+        number of in-flight segmentation calls; it is clamped to between 1
+        and MAX_BATCH_CONCURRENCY, and to the number of inputs. As for single
+        requests, each item is probed and checked against the render budget
+        before it is read, and holds its estimated memory until it is
+        written. A failing item yields an ``error`` result and does not stop
+        the batch.
+        """
+        from app.utils.background import render_background_variants
+        paths = self._resolve_batch_inputs(inputs, input_dir)
+        concurrency = concurrency or settings.BATCH_CONCURRENCY
+        # Without a segment worker nothing would ever reach ``results``
+        concurrency = max(1, min(concurrency, settings.MAX_BATCH_CONCURRENCY, len(paths)))
+        variant = {"background_color": bg_color, "aspect_ratio": aspect_ratio, "output_format": "JPEG"}
+        aspect_str = f"_{aspect_ratio[0]}_{aspect_ratio[1]}" if aspect_ratio else ""
+
+        todo: asyncio.Queue = asyncio.Queue()
+        segmented: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(paths):
+            todo.put_nowait(item)
+
+        async def segment_worker():
+            while True:
+                try:
+                    index, path = todo.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                memory = 0
+                try:
+                    # Reject oversized inputs from the header, before reading them
+                    image_size, image_format = await asyncio.to_thread(probe_image, path)
+                    peak_bytes = check_render_budget(image_size, [variant], image_format)
+                    weight = os.path.getsize(path) + peak_bytes
+                    memory = await retry_when_busy(
+                        lambda: self.admission.memory.acquire(weight), settings.BUSY_RETRY_TIMEOUT
+                    )
+                    image_bytes = await asyncio.to_thread(self._read_file, path)
+                    success, mask = await retry_when_busy(
+                        lambda: self.segmentation_service.segment_bytes(image_bytes), settings.BUSY_RETRY_TIMEOUT
+                    )
+                    if not success:
+                        raise Exception(f"Segmentation failed: {mask}")
+                except Exception as e:
+                    if memory:
+                        self.admission.memory.release(memory)
+                    await results.put({"index": index, "input": path, "status": "error", "error": str(e)})
+                    continue
+                await segmented.put((index, path, image_bytes, mask, memory))
+
+        async def composite_worker():
+            while True:
+                item = await segmented.get()
+                if item is None:
+                    return
+                index, path, image_bytes, mask, memory = item
+                try:
+                    name, _ = os.path.splitext(os.path.basename(path))
+                    final_output_path = os.path.join(self.OUTPUT_DIR, f"{name}_processed{aspect_str}.jpg")
+                    [(processed_bytes, encode_seconds)] = await self._run_compositing(
+                        render_background_variants, image_bytes, [variant], mask
+                    )
+                    observe_stage("encode_output", encode_seconds)
+                    BYTES_IN.inc(len(image_bytes))
+                    BYTES_OUT.inc(len(processed_bytes))
+                    await asyncio.to_thread(self._write_file, final_output_path, processed_bytes)
+                    await results.put({
+                        "index": index,
+                        "input": path,
+                        "status": "ok",
+                        "final_path": final_output_path,
+                        "size": len(processed_bytes),
+                        "encode_ms": round(encode_seconds * 1000, 1)
+                    })
+                except Exception as e:
+                    await results.put({"index": index, "input": path, "status": "error", "error": str(e)})
+                finally:
+                    self.admission.memory.release(memory)
+
+        async def run_pipeline():
+            composite_tasks = [asyncio.create_task(composite_worker()) for _ in range(self.executor.max_workers)]
+            try:
+                await asyncio.gather(*(segment_worker() for _ in range(concurrency)))
+                for _ in composite_tasks:
+                    await segmented.put(None)
+                await asyncio.gather(*composite_tasks)
+            finally:
+                for task in composite_tasks:
+                    task.cancel()
+                # Items left behind by a cancelled batch still hold memory
+                while not segmented.empty():
+                    item = segmented.get_nowait()
+                    if item is not None:
+                        self.admission.memory.release(item[-1])
+
+        pipeline = asyncio.create_task(run_pipeline())
+        try:
+            for completed in range(1, len(paths) + 1):
+                result = await results.get()
+                result.update({"completed": completed, "total": len(paths)})
+                yield result
+            await pipeline
+        finally:
+            pipeline.cancel()
+
+    async def process_batch(self, **kwargs) -> List[dict]:
+        """Process a batch and return all per-item results in input order"""
+        results = [result async for result in self.iter_batch(**kwargs)]
+        return sorted(results, key=lambda r: r["index"])
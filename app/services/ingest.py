@@ -0,0 +1,307 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.image_service import IMAGE_EXTENSIONS
+from app.services.job_queue import DONE, FAILED
+from app.utils.admission import set_client
+from app.utils.encoding import EXTENSIONS
+from app.utils.executor import retry_when_busy
+from app.utils.limits import ImageTooLargeError
+
+logger = logging.getLogger(__name__)
+
+# Failed with a transient error (e.g. segmentation backend down); retried with backoff
+RETRY = "retry"
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    Persistent record of ingested files.
+
+    One row per input path with the size, mtime and content hash it had
+    when it was processed, so unchanged files are skipped after a restart
+    and files that were only touched are recognised by their hash.
+    ``attempts`` counts consecutive transient failures (status RETRY).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL,
+                status TEXT NOT NULL,
+                output TEXT,
+                error TEXT,
+                processed_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]
+        if "attempts" not in columns:
+            # Manifest written before transient failures were retried
+            self._conn.execute("ALTER TABLE files ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256, status)")
+        self._conn.commit()
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[tuple]:
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+            self._conn.commit()
+            return rows
+
+    def entries(self) -> Dict[str, Tuple[int, float, str, str, int, float]]:
+        """Map of path to (size, mtime, sha256, status, attempts, processed_at)"""
+        rows = self._execute("SELECT path, size, mtime, sha256, status, attempts, processed_at FROM files")
+        return {row[0]: row[1:] for row in rows}
+
+    def output_for(self, sha256: str) -> Optional[str]:
+        """Output of an earlier successfully processed file with the same content"""
+        rows = self._execute(
+            "SELECT output FROM files WHERE sha256 = ? AND status = ? LIMIT 1", (sha256, DONE)
+        )
+        return rows[0][0] if rows else None
+
+    def record(self, path: str, size: int, mtime: float, sha256: str, status: str,
+               output: Optional[str] = None, error: Optional[str] = None, attempts: int = 0) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, sha256, status, output, error, time.time(), attempts)
+        )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) FROM files GROUP BY status")
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class IngestWorker:
+    """
+    Processes images dropped into INPUT_DIR.
+
+    A scanner walks INPUT_DIR every INGEST_SCAN_INTERVAL seconds and queues
+    files that are new or changed since the manifest last saw them; files
+    modified within INGEST_SETTLE_SECONDS are left for the next scan as
+    they may still be being written. INGEST_WORKERS workers run each file
+    through ImageService.process_path_image and record the outcome.
+
+    A file whose content duplicates an already processed one gets a hard
+    link (or copy) of that output under its own name. Files failing with a
+    transient error, such as an unavailable segmentation backend, are
+    retried after INGEST_RETRY_BACKOFF seconds, doubling each time, up to
+    INGEST_MAX_ATTEMPTS tries; files that cannot be decoded or are over
+    the size limits fail permanently and are retried once they change.
+    """
+
+    def __init__(self, image_service):
+        self.image_service = image_service
+        self.input_dir = settings.INPUT_DIR
+        self.workers = settings.INGEST_WORKERS
+        self.manifest: Optional[IngestManifest] = None
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._pending: set = set()
+        self._active = 0
+        self._completed_at: deque = deque(maxlen=10000)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def backlog(self) -> int:
+        """Files queued or being processed"""
+        return len(self._pending)
+
+    def throughput(self, window: float = 60.0) -> float:
+        """Files processed per second over the last ``window`` seconds"""
+        cutoff = time.monotonic() - window
+        return sum(1 for t in self._completed_at if t >= cutoff) / window
+
+    async def start(self) -> None:
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.manifest = await asyncio.to_thread(IngestManifest, settings.INGEST_MANIFEST_PATH)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._scan_loop()))
+        logger.info(f"Ingesting images from {self.input_dir} with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+    def _list_files(self) -> List[Tuple[str, int, float]]:
+        """(path, size, mtime) of every image under INPUT_DIR"""
+        files = []
+        for root, _, names in os.walk(self.input_dir):
+            for name in names:
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return sorted(files)
+
+    async def scan(self) -> int:
+        """
+        Queue new and changed files.
+
+        Returns:
+            Number of files queued
+        """
+        files = await asyncio.to_thread(self._list_files)
+        known = await asyncio.to_thread(self.manifest.entries)
+        settled_before = time.time() - settings.INGEST_SETTLE_SECONDS
+        queued = 0
+        for path, size, mtime in files:
+            if path in self._pending or mtime > settled_before:
+                continue
+            entry = known.get(path)
+            if entry is not None and entry[0] == size and entry[1] == mtime and not self._retry_due(entry):
+                continue
+            self._pending.add(path)
+            self.queue.put_nowait((path, size, mtime, entry))
+            queued += 1
+        if queued:
+            logger.info(f"Queued {queued} files for ingest")
+        return queued
+
+    @staticmethod
+    def _retry_due(entry: tuple) -> bool:
+        """Whether an unchanged file's transient failure should be retried now"""
+        _, _, _, status, attempts, processed_at = entry
+        if status != RETRY:
+            return False
+        return time.time() >= processed_at + settings.INGEST_RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+
+    async def _scan_loop(self) -> None:
+        while True:
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error(f"Ingest scan failed: {str(e)}")
+            await asyncio.sleep(settings.INGEST_SCAN_INTERVAL)
+
+    def _output_name(self, path: str) -> str:
+        relative = os.path.splitext(os.path.relpath(path, self.input_dir))[0]
+        aspect_ratio = settings.INGEST_ASPECT_RATIO
+        aspect_str = f"_{aspect_ratio[0]}_{aspect_ratio[1]}" if aspect_ratio else ""
+        extension = EXTENSIONS[settings.INGEST_OUTPUT_FORMAT.upper()]
+        return f"{relative.replace(os.sep, '__')}_processed{aspect_str}.{extension}"
+
+    @staticmethod
+    def _link_output(source: str, target: str) -> None:
+        """Give ``target`` the same output as ``source``: a hard link, or a copy across devices"""
+        if os.path.exists(target):
+            if os.path.samefile(source, target):
+                return
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    async def _process(self, path: str, size: int, mtime: float, entry: Optional[tuple]) -> None:
+        sha256 = await asyncio.to_thread(file_digest, path)
+        if entry is not None and entry[2] == sha256 and entry[3] == DONE:
+            # Touched but unchanged
+            await asyncio.to_thread(self.manifest.record, path, size, mtime, sha256, DONE,
+                                    await asyncio.to_thread(self.manifest.output_for, sha256))
+            self.skipped += 1
+            return
+        output_path = os.path.join(self.image_service.OUTPUT_DIR, self._output_name(path))
+        duplicate = await asyncio.to_thread(self.manifest.output_for, sha256)
+        if (duplicate is not None and os.path.exists(duplicate)
+                and os.path.splitext(duplicate)[1] == os.path.splitext(output_path)[1]):
+            # Same content as a processed file: reuse its output under this file's name
+            await asyncio.to_thread(self._link_output, duplicate, output_path)
+            await asyncio.to_thread(self.manifest.record, path, size, mtime, sha256, DONE, output_path)
+            self.skipped += 1
+            return
+
+        # Consecutive transient failures of this same content
+        attempts = entry[4] if entry is not None and entry[2] == sha256 and entry[3] == RETRY else 0
+        try:
+            result = await retry_when_busy(lambda: self.image_service.process_path_image(
+                input_image=path,
+                bg_color=settings.INGEST_BG_COLOR,
+                output_image=self._output_name(path),
+                aspect_ratio=settings.INGEST_ASPECT_RATIO,
+                output_format=settings.INGEST_OUTPUT_FORMAT.upper()
+            ), settings.BUSY_RETRY_TIMEOUT)
+        except Exception as e:
+            from PIL import UnidentifiedImageError
+            attempts += 1
+            permanent = isinstance(e, (ImageTooLargeError, UnidentifiedImageError, ValueError))
+            status = FAILED if permanent or attempts >= settings.INGEST_MAX_ATTEMPTS else RETRY
+            logger.error(f"Ingest of {path} failed ({status}, attempt {attempts}): {str(e)}")
+            await asyncio.to_thread(self.manifest.record, path, size, mtime, sha256, status, None, str(e), attempts)
+            self.failed += 1
+            return
+        await asyncio.to_thread(self.manifest.record, path, size, mtime, sha256, DONE, result["final_path"])
+        self.processed += 1
+        self._completed_at.append(time.monotonic())
+
+    async def _worker(self) -> None:
+        set_client("ingest")
+        while True:
+            path, size, mtime, entry = await self.queue.get()
+            self._active += 1
+            try:
+                await self._process(path, size, mtime, entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingest of {path} failed: {str(e)}")
+                self.failed += 1
+            finally:
+                self._active -= 1
+                self._pending.discard(path)
+
+    async def status(self) -> dict:
+        counts = await asyncio.to_thread(self.manifest.counts) if self.manifest is not None else {}
+        return {
+            "enabled": True,
+            "input_dir": self.input_dir,
+            "workers": self.workers,
+            "backlog": self.backlog,
+            "active": self._active,
+            "processed": self.processed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "throughput_per_sec": round(self.throughput(), 3),
+            "manifest": counts,
+        }
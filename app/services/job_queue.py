@@ -0,0 +1,322 @@
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.admission import set_client
+from app.utils.executor import retry_when_busy
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue(ABC):
+    """
+    Storage backend for asynchronous processing jobs.
+
+    Jobs are plain dicts with ``id``, ``kind``, ``params``, ``status``,
+    ``result``, ``error``, ``created_at`` and ``updated_at`` keys.
+    ``params`` is dropped (None) once a job is done or has failed, so
+    finished jobs do not keep their inputs for JOB_RESULT_TTL.
+    """
+
+    @abstractmethod
+    async def submit(self, kind: str, params: dict) -> str:
+        """Queue a job, return its id"""
+
+    @abstractmethod
+    async def next_job(self) -> dict:
+        """Wait for the next queued job and mark it running"""
+
+    @abstractmethod
+    async def complete(self, job_id: str, result: dict) -> None:
+        """Mark a job done with its result"""
+
+    @abstractmethod
+    async def fail(self, job_id: str, error: str) -> None:
+        """Mark a job failed with its error message"""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[dict]:
+        """The job with this id, or None"""
+
+    @abstractmethod
+    async def purge_expired(self, ttl: float) -> int:
+        """Drop finished jobs older than ``ttl`` seconds, return the count"""
+
+    @abstractmethod
+    async def depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _new_job(kind: str, params: dict) -> dict:
+        now = time.time()
+        return {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+class InMemoryJobQueue(JobQueue):
+    """Process-local queue; jobs are lost on restart"""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._pending: asyncio.Queue = asyncio.Queue()
+
+    async def submit(self, kind: str, params: dict) -> str:
+        job = self._new_job(kind, params)
+        self._jobs[job["id"]] = job
+        self._pending.put_nowait(job["id"])
+        return job["id"]
+
+    async def next_job(self) -> dict:
+        while True:
+            job = self._jobs.get(await self._pending.get())
+            if job is not None and job["status"] == QUEUED:
+                job["status"] = RUNNING
+                job["updated_at"] = time.time()
+                return job
+
+    async def _finish(self, job_id: str, status: str, result: Optional[dict], error: Optional[str]) -> None:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(status=status, params=None, result=result, error=error, updated_at=time.time())
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await self._finish(job_id, DONE, result, None)
+
+    async def fail(self, job_id: str, error: str) -> None:
+        await self._finish(job_id, FAILED, None, error)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    async def purge_expired(self, ttl: float) -> int:
+        cutoff = time.time() - ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in (DONE, FAILED) and job["updated_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def depth(self) -> int:
+        return self._pending.qsize()
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite-backed queue; jobs and results survive restarts.
+
+    Jobs that were running when the process stopped are put back in the
+    queue on startup.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+        self._conn.commit()
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[tuple]:
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+            self._conn.commit()
+            return rows
+
+    @staticmethod
+    def _row_to_job(row: tuple) -> dict:
+        job_id, kind, params, status, result, error, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "params": json.loads(params),
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    async def submit(self, kind: str, params: dict) -> str:
+        job = self._new_job(kind, params)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, NULL, NULL, ?, ?)",
+            (job["id"], kind, json.dumps(params), QUEUED, job["created_at"], job["updated_at"])
+        )
+        self._wakeup.set()
+        return job["id"]
+
+    def _claim(self) -> Optional[dict]:
+        # One statement, so two workers (or processes) sharing the database
+        # cannot both claim the same job
+        rows = self._execute(
+            """
+            UPDATE jobs SET status = ?, updated_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) AND status = ?
+            RETURNING *
+            """,
+            (RUNNING, time.time(), QUEUED, QUEUED)
+        )
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def next_job(self) -> dict:
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is not None:
+                return job
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, params = 'null', result = ?, updated_at = ? WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+
+    async def fail(self, job_id: str, error: str) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, params = 'null', error = ?, updated_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        rows = await asyncio.to_thread(self._execute, "SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def purge_expired(self, ttl: float) -> int:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ? RETURNING id",
+            (DONE, FAILED, time.time() - ttl)
+        )
+        return len(rows)
+
+    async def depth(self) -> int:
+        rows = await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,))
+        return rows[0][0]
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_queue() -> JobQueue:
+    """Build the job queue backend selected by settings"""
+    if settings.JOB_QUEUE_BACKEND == "memory":
+        return InMemoryJobQueue()
+    if settings.JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue(settings.JOB_SQLITE_PATH)
+    raise ValueError(f"Unsupported job queue backend: {settings.JOB_QUEUE_BACKEND}")
+
+
+class JobManager:
+    """Worker pool that drains a JobQueue through an ImageService"""
+
+    def __init__(self, image_service, queue: Optional[JobQueue] = None):
+        self.image_service = image_service
+        self.queue = queue
+        self.workers = settings.JOB_WORKERS
+        self.result_ttl = settings.JOB_RESULT_TTL
+        self._tasks: List[asyncio.Task] = []
+        self._handlers = {
+            "base64": image_service.process_base64_image,
+            "path": image_service.process_path_image,
+            "variants": image_service.process_base64_variants,
+        }
+
+    async def start(self) -> None:
+        if self.queue is None:
+            self.queue = create_job_queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.queue is not None:
+            await self.queue.close()
+
+    async def submit(self, kind: str, params: dict) -> str:
+        if kind not in self._handlers:
+            raise ValueError(f"Unsupported job kind: {kind}")
+        return await self.queue.submit(kind, params)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.queue.get(job_id)
+
+    async def _run(self, job: dict) -> dict:
+        handler = self._handlers[job["kind"]]
+        return await retry_when_busy(lambda: handler(**job["params"]), settings.BUSY_RETRY_TIMEOUT)
+
+    async def _worker(self) -> None:
+        set_client("jobs")
+        while True:
+            job = await self.queue.next_job()
+            try:
+                result = await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed: {str(e)}")
+                await self.queue.fail(job["id"], str(e))
+            else:
+                await self.queue.complete(job["id"], result)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.result_ttl, 60))
+            try:
+                purged = await self.queue.purge_expired(self.result_ttl)
+                if purged:
+                    logger.info(f"Purged {purged} expired jobs")
+            except Exception as e:
+                logger.error(f"Failed to purge expired jobs: {str(e)}")
@@ -0,0 +1,220 @@
+import math
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import observe_stage, ADMISSION_REJECTED
+from app.utils.executor import ExecutorBusyError
+
+# Client the current request is admitted for; set by the HTTP middleware and
+# by background workers
+_client: ContextVar[str] = ContextVar("admission_client", default="internal")
+
+
+def set_client(client: str) -> None:
+    """Attribute work in the current context to ``client`` for fair scheduling"""
+    _client.set(client)
+
+
+def current_client() -> str:
+    return _client.get()
+
+
+class AdmissionRejectedError(ExecutorBusyError):
+    """
+    Raised when a request cannot be admitted.
+
+    ``status_code`` is 429 when the client already has too many requests
+    waiting and 503 when the service as a whole is saturated.
+    """
+
+    def __init__(self, message: str, retry_after: int = 1, status_code: int = 503):
+        super().__init__(message, retry_after)
+        self.status_code = status_code
+
+
+class FairLimiter:
+    """
+    Weighted semaphore with a bounded, per-client fair wait queue.
+
+    Up to ``capacity`` units (calls, jobs or bytes) are held at once.
+    Requests that do not fit wait in a queue per client, and freed capacity
+    goes to the clients in round-robin order, so one client's burst cannot
+    delay everyone else. At most ``queue_size`` requests wait in total and
+    ``client_queue_size`` per client; a request that waits longer than
+    ``timeout`` seconds is rejected.
+    """
+
+    def __init__(self, name: str, capacity: int, queue_size: int, client_queue_size: int, timeout: float):
+        self.name = name
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.client_queue_size = client_queue_size
+        self.timeout = timeout
+        self.in_use = 0
+        self.holders = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._queues: "OrderedDict[str, Deque[Tuple[asyncio.Future, int]]]" = OrderedDict()
+        self._avg_hold = 0.0
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a queued request would be admitted"""
+        waves = 1 + self.waiting / max(1, self.holders)
+        return max(1, math.ceil(waves * self._avg_hold))
+
+    def _reject(self, reason: str, message: str, status_code: int) -> AdmissionRejectedError:
+        self.rejected += 1
+        ADMISSION_REJECTED.inc(resource=self.name, reason=reason)
+        return AdmissionRejectedError(message, retry_after=self._retry_after(), status_code=status_code)
+
+    def _grant(self, weight: int) -> None:
+        self.in_use += weight
+        self.holders += 1
+
+    def _wake(self) -> None:
+        """Hand freed capacity to waiting clients in round-robin order"""
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            future, weight = queue[0]
+            if self.in_use + weight > self.capacity:
+                return
+            queue.popleft()
+            self.waiting -= 1
+            self._grant(weight)
+            future.set_result(None)
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+
+    def _remove(self, client: str, waiter: Tuple[asyncio.Future, int]) -> None:
+        queue = self._queues[client]
+        queue.remove(waiter)
+        self.waiting -= 1
+        if not queue:
+            del self._queues[client]
+        # A large waiter at the head may have been blocking smaller ones
+        self._wake()
+
+    async def acquire(self, weight: int = 1, client: Optional[str] = None) -> int:
+        """
+        Wait for ``weight`` units of capacity.
+
+        A weight above the capacity is clamped to it, so an oversized
+        request runs alone instead of never being admitted.
+
+        Returns:
+            The weight actually held, to pass to release
+
+        Raises:
+            AdmissionRejectedError: If the queue is full or the wait timed out
+        """
+        weight = min(max(weight, 1), self.capacity)
+        if not self._queues and self.in_use + weight <= self.capacity:
+            self._grant(weight)
+            return weight
+
+        client = client or current_client()
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= self.client_queue_size:
+            raise self._reject(
+                "client_queue_full",
+                f"Too many queued {self.name} requests from this client ({len(queue)})",
+                status_code=429
+            )
+        if self.waiting >= self.queue_size:
+            raise self._reject(
+                "queue_full", f"{self.name.capitalize()} queue is full ({self.waiting}/{self.queue_size})", 503
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, weight)
+        self._queues.setdefault(client, deque()).append(waiter)
+        self.waiting += 1
+        start = asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as the wait ended; give the capacity back
+                self.release(weight)
+            else:
+                future.cancel()
+                self._remove(client, waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject(
+                "timeout", f"Waited more than {self.timeout:g}s for {self.name} capacity", 503
+            ) from None
+        observe_stage(f"queue_{self.name}", asyncio.get_running_loop().time() - start)
+        return weight
+
+    def release(self, weight: int, held_for: Optional[float] = None) -> None:
+        self.in_use -= weight
+        self.holders -= 1
+        if held_for is not None:
+            self._avg_hold = held_for if not self._avg_hold else 0.8 * self._avg_hold + 0.2 * held_for
+        self._wake()
+
+    @asynccontextmanager
+    async def hold(self, weight: int = 1, client: Optional[str] = None):
+        """Hold ``weight`` units for the duration of the block, see acquire"""
+        weight = await self.acquire(weight, client)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            yield
+        finally:
+            self.release(weight, loop.time() - start)
+
+    def snapshot(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "holders": self.holders,
+            "waiting": self.waiting,
+            "waiting_clients": len(self._queues),
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionController:
+    """
+    Admission limits for the request pipeline.
+
+    - ``segmentation``: in-flight segmentation backend calls
+    - ``compositing``: in-flight compositing jobs
+    - ``memory``: estimated bytes held by requests being processed
+
+    Each resource is a FairLimiter; requests take them in that order
+    (memory, then segmentation, then compositing) so waits cannot deadlock.
+    """
+
+    def __init__(self, segmentation: int, compositing: int, memory_bytes: int,
+                 queue_size: int, client_queue_size: int, timeout: float):
+        self.segmentation = FairLimiter("segmentation", segmentation, queue_size, client_queue_size, timeout)
+        self.compositing = FairLimiter("compositing", compositing, queue_size, client_queue_size, timeout)
+        self.memory = FairLimiter("memory", memory_bytes, queue_size, client_queue_size, timeout)
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            segmentation=settings.ADMISSION_SEGMENTATION_LIMIT,
+            compositing=settings.ADMISSION_COMPOSITING_LIMIT or settings.COMPOSITE_WORKERS,
+            memory_bytes=settings.ADMISSION_MEMORY_BYTES,
+            queue_size=settings.ADMISSION_QUEUE_SIZE,
+            client_queue_size=settings.ADMISSION_CLIENT_QUEUE_SIZE,
+            timeout=settings.ADMISSION_QUEUE_TIMEOUT
+        )
+
+    @property
+    def limiters(self) -> Tuple[FairLimiter, ...]:
+        return self.segmentation, self.compositing, self.memory
+
+    def snapshot(self) -> Dict:
+        return {limiter.name: limiter.snapshot() for limiter in self.limiters}
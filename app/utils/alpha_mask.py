@@ -0,0 +1,153 @@
+import zlib
+import struct
+import hashlib
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional, Tuple
+
+# Pillow is imported on first use, so MASK_EXTENSION can be imported without it
+if TYPE_CHECKING:
+    from PIL import Image
+
+MASK_MAGIC = b"AMSK"
+MASK_VERSION = 1
+MASK_EXTENSION = ".amask"
+# Masks are mostly long runs of 0 and 255; higher levels gain little
+COMPRESS_LEVEL = 6
+# The body holds one bit per pixel (a hard mask) instead of one byte
+FLAG_BITPACKED = 1
+
+# magic, version, flags, mask width and height, bounding box (left, top,
+# right, bottom) and the SHA-256 digest of the source image
+_HEADER = struct.Struct("<4sBBxxIIIIII32s")
+
+
+class MaskFormatError(ValueError):
+    """Raised for data that is not an alpha mask, or is the mask of another image"""
+
+
+class AlphaMask:
+    """
+    Segmentation result stored as a single alpha channel.
+
+    Only the subject's bounding box is kept, as a zlib-compressed 8-bit
+    channel, or bit-packed when every pixel is either fully opaque or fully
+    transparent; everything outside the box is transparent. The RGB pixels
+    come from the source image, identified by its SHA-256 digest, when the
+    mask is applied (see apply_mask).
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        bbox: Tuple[int, int, int, int],
+        source_digest: str,
+        alpha: Optional["Image.Image"]
+    ):
+        self.size = size
+        self.bbox = bbox
+        self.source_digest = source_digest
+        # Alpha of the bounding box, None when nothing is opaque
+        self.alpha = alpha
+
+    @classmethod
+    def from_alpha(cls, alpha: "Image.Image", source_digest: str) -> "AlphaMask":
+        """Build a mask from a full-size "L" alpha channel"""
+        size = alpha.size
+        bbox = alpha.getbbox()
+        if bbox is None:
+            return cls(size, (0, 0, 0, 0), source_digest, None)
+        if bbox != (0, 0) + size:
+            alpha = alpha.crop(bbox)
+        return cls(size, bbox, source_digest, alpha)
+
+    @classmethod
+    def from_bytes(cls, data) -> "AlphaMask":
+        """
+        Parse a serialised mask.
+
+        Raises:
+            MaskFormatError: If ``data`` is not a valid mask
+        """
+        if len(data) < _HEADER.size:
+            raise MaskFormatError("Not an alpha mask: too short")
+        magic, version, flags, width, height, left, top, right, bottom, digest = _HEADER.unpack_from(data)
+        if magic != MASK_MAGIC or version != MASK_VERSION:
+            raise MaskFormatError("Not an alpha mask, or an unsupported version")
+        alpha = None
+        if right > left and bottom > top:
+            from PIL import Image
+            mode = "1" if flags & FLAG_BITPACKED else "L"
+            try:
+                raw = zlib.decompress(memoryview(data)[_HEADER.size:])
+                alpha = Image.frombytes(mode, (right - left, bottom - top), raw)
+            except (zlib.error, ValueError) as e:
+                raise MaskFormatError(f"Corrupt alpha mask: {str(e)}")
+            if mode == "1":
+                alpha = alpha.convert("L")
+        return cls((width, height), (left, top, right, bottom), digest.hex(), alpha)
+
+    def to_bytes(self) -> bytes:
+        """Serialise the mask: fixed header followed by the compressed bounding box"""
+        flags = 0
+        body = b""
+        if self.alpha is not None:
+            histogram = self.alpha.histogram()
+            if not any(histogram[1:255]):
+                from PIL import Image
+                flags |= FLAG_BITPACKED
+                raw = self.alpha.convert("1", dither=Image.Dither.NONE).tobytes()
+            else:
+                raw = self.alpha.tobytes()
+            body = zlib.compress(raw, COMPRESS_LEVEL)
+        header = _HEADER.pack(
+            MASK_MAGIC, MASK_VERSION, flags, *self.size, *self.bbox, bytes.fromhex(self.source_digest)
+        )
+        return header + body
+
+    def full_alpha(self) -> "Image.Image":
+        """The alpha channel at the mask's full size"""
+        if self.alpha is not None and self.bbox == (0, 0) + self.size:
+            return self.alpha
+        from PIL import Image
+        alpha = Image.new("L", self.size, 0)
+        if self.alpha is not None:
+            alpha.paste(self.alpha, self.bbox[:2])
+        return alpha
+
+
+def encode_mask(alpha: "Image.Image", source_digest: str) -> bytes:
+    """Serialise a full-size "L" alpha channel for the image with SHA-256 ``source_digest``"""
+    return AlphaMask.from_alpha(alpha, source_digest).to_bytes()
+
+
+def apply_mask(image_bytes: bytes, mask_bytes: bytes, target: Optional[Tuple[int, int]] = None) -> "Image.Image":
+    """
+    Cut the subject out of the source image with its mask.
+
+    Args:
+        image_bytes: Encoded source image the mask was made for
+        mask_bytes: Serialised AlphaMask
+        target: Smallest size the result is needed at; JPEG sources are
+            then decoded at reduced scale (``Image.draft``), see
+            limits.draft_size
+
+    Returns:
+        RGBA image at the source resolution, or as decoded for ``target``
+
+    Raises:
+        MaskFormatError: If the mask is invalid or belongs to another image
+    """
+    from PIL import Image
+    mask = AlphaMask.from_bytes(mask_bytes)
+    if hashlib.sha256(image_bytes).hexdigest() != mask.source_digest:
+        raise MaskFormatError("Alpha mask belongs to a different image")
+    with Image.open(BytesIO(image_bytes)) as image:
+        if target is not None:
+            image.draft("RGB", target)
+        result = image.convert("RGB")
+    alpha = mask.full_alpha()
+    if alpha.size != result.size:
+        reducing = alpha.width > result.width
+        alpha = alpha.resize(result.size, Image.BOX if reducing else Image.BICUBIC)
+    result.putalpha(alpha)
+    return result
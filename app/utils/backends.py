@@ -0,0 +1,150 @@
+import time
+import random
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class SegmentationBackend:
+    """One segmentation endpoint with load, latency and circuit breaker state"""
+
+    def __init__(self, url: str, health_path: str = "", window: int = 200):
+        self.url = url
+        self.health_url = self._health_url(url, health_path) if health_path else None
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.latencies: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+
+    @staticmethod
+    def _health_url(url: str, health_path: str) -> str:
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, parts.netloc, health_path, "", ""))
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "ewma_latency": self.ewma_latency,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class BackendPool:
+    """
+    Chooses segmentation backends and tracks their health.
+
+    Passive checks count consecutive request failures; after
+    ``failure_threshold`` of them the backend's circuit opens and it gets
+    no traffic for ``cooldown`` seconds, after which a single trial request
+    is let through (half-open). Active health checks mark backends that
+    stop answering as unhealthy until they respond again.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        strategy: str = "least_outstanding",
+        health_path: str = "",
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        hedge_percentile: float = 0.0,
+        hedge_min_samples: int = 20
+    ):
+        if strategy not in ("least_outstanding", "latency_weighted"):
+            raise ValueError(f"Unsupported balancing strategy: {strategy}")
+        self.backends = [SegmentationBackend(url, health_path) for url in urls]
+        if not self.backends:
+            raise ValueError("At least one segmentation backend is required")
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._recent: deque = deque(maxlen=500)
+
+    def _available(self, backend: SegmentationBackend, now: float) -> bool:
+        if not backend.healthy:
+            return False
+        if backend.state == OPEN:
+            if now - backend.opened_at < self.cooldown:
+                return False
+            backend.state = HALF_OPEN
+            return backend.outstanding == 0
+        if backend.state == HALF_OPEN:
+            # Only one trial request at a time
+            return backend.outstanding == 0
+        return True
+
+    def _score(self, backend: SegmentationBackend) -> float:
+        if self.strategy == "least_outstanding":
+            return backend.outstanding
+        # Expected wait: latency estimate scaled by the work already queued there
+        latency = backend.ewma_latency if backend.ewma_latency is not None else 0.0
+        return latency * (backend.outstanding + 1)
+
+    def choose(self, exclude: Iterable[SegmentationBackend] = ()) -> Optional[SegmentationBackend]:
+        """Pick the best available backend, or None if all are excluded or down"""
+        now = time.monotonic()
+        excluded = set(id(b) for b in exclude)
+        candidates = [b for b in self.backends if id(b) not in excluded and self._available(b, now)]
+        if not candidates:
+            return None
+        best = min(self._score(b) for b in candidates)
+        return random.choice([b for b in candidates if self._score(b) == best])
+
+    def acquire(self, backend: SegmentationBackend) -> None:
+        backend.outstanding += 1
+        backend.requests += 1
+
+    def release(self, backend: SegmentationBackend) -> None:
+        backend.outstanding -= 1
+
+    def record_success(self, backend: SegmentationBackend, latency: float) -> None:
+        backend.latencies.append(latency)
+        self._recent.append(latency)
+        backend.ewma_latency = latency if backend.ewma_latency is None else 0.8 * backend.ewma_latency + 0.2 * latency
+        backend.consecutive_failures = 0
+        if backend.state != CLOSED:
+            logger.info(f"Segmentation backend recovered: {backend.url}")
+        backend.state = CLOSED
+
+    def record_failure(self, backend: SegmentationBackend) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+            if backend.state != OPEN:
+                logger.warning(f"Opening circuit for segmentation backend: {backend.url}")
+            backend.state = OPEN
+            backend.opened_at = time.monotonic()
+
+    def set_health(self, backend: SegmentationBackend, healthy: bool) -> None:
+        if backend.healthy != healthy:
+            logger.warning(f"Segmentation backend {backend.url} is now {'healthy' if healthy else 'unhealthy'}")
+        backend.healthy = healthy
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency after which a hedged request is sent, None to not hedge"""
+        if not self.hedge_percentile or len(self.backends) < 2 or len(self._recent) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._recent)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        return [backend.snapshot() for backend in self.backends]
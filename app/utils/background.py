@@ -1,20 +1,33 @@
 import os
-import sys
+import time
+from io import BytesIO
 from PIL import Image, ImageFilter
-from typing import Tuple, Optional, Literal
+from typing import Dict, List, Tuple, Optional, Literal
 import logging
 
-# Add project root to Python path
+# Used by the example in main(); run it as ``python -m app.utils.background``
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-sys.path.append(project_root)
 
 from app.core.config import settings
+from app.utils.alpha_mask import apply_mask
+from app.utils.composite import NumpyCompositor
+from app.utils.encoding import MIME_TYPES, encode_image, prepare_for_save, save_options
+from app.utils.limits import canvas_size, decode_target, fit_size, target_dimensions, uses_tiles
+from app.utils.tiled import render_tiled
 
 logger = logging.getLogger(__name__)
 
+def format_for_path(path: str) -> Optional[str]:
+    """Pillow format name implied by a file extension"""
+    return Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+
 class BackgroundProcessor:
     def __init__(self):
         self.supported_sharpen_methods = ['sharpen', 'unsharp']
+        self.engine = settings.COMPOSITE_ENGINE
+        if self.engine not in ('pillow', 'numpy'):
+            raise ValueError(f"Unsupported compositing engine: {self.engine}")
+        self.numpy_compositor = NumpyCompositor()
         self._ensure_output_dir()
 
     def _ensure_output_dir(self) -> None:
@@ -58,17 +71,195 @@ class BackgroundProcessor:
         Returns:
             Tuple of (target_width, target_height)
         """
-        iw, ih = image_size
-        orig_ratio = iw / ih
+        return target_dimensions(image_size, target_ratio)
+
+    def compose(
+        self,
+        image: Image.Image,
+        background_color: Tuple[int, int, int],
+        target_aspect_ratio: Optional[Tuple[int, int]] = None,
+        sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None
+    ) -> Image.Image:
+        """
+        Composite an image onto a solid background in memory.
+        
+        Args:
+            image: Segmented PIL Image (converted to RGBA if needed)
+            background_color: RGB background color tuple
+            target_aspect_ratio: Optional target aspect ratio (width, height)
+            sharpen_method: Optional sharpening method to apply
+            
+        Returns:
+            Composited RGB PIL Image (RGBX with the NumPy engine, see
+            prepare_for_save)
+        """
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        
+        # Apply sharpening if method specified
+        if sharpen_method:
+            image = self.sharpen_image(image, method=sharpen_method)
+        
+        if self.engine == 'numpy':
+            target_size = None
+            if target_aspect_ratio:
+                target_ratio = target_aspect_ratio[0] / target_aspect_ratio[1]
+                target_size = self.calculate_target_dimensions(image.size, target_ratio)
+            return self.numpy_compositor.composite(image, background_color, target_size)
+        
+        if not target_aspect_ratio:
+            logger.info("No target aspect ratio set, using original size")
+            background = Image.new("RGBA", image.size, background_color)
+            background.paste(image, (0, 0), image)
+        else:
+            # Calculate target dimensions
+            target_ratio = target_aspect_ratio[0] / target_aspect_ratio[1]
+            target_w, target_h = self.calculate_target_dimensions(image.size, target_ratio)
+            
+            logger.info(f"Original ratio: {image.size[0]/image.size[1]:.2f}, "
+                      f"Target ratio: {target_ratio:.2f}")
+            
+            # Create new background with target dimensions
+            background = Image.new("RGBA", (target_w, target_h), background_color)
+            
+            # Calculate centering coordinates
+            x = (target_w - image.size[0]) // 2
+            y = (target_h - image.size[1]) // 2
+            
+            background.paste(image, (x, y), image)
+        
+        return background.convert("RGB")
+
+    def canvas_size(self, image_size: Tuple[int, int], target_aspect_ratio: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+        """Dimensions of the composited output for a subject of image_size"""
+        return canvas_size(image_size, target_aspect_ratio)
+
+    def fit_size(
+        self,
+        image_size: Tuple[int, int],
+        target_aspect_ratio: Optional[Tuple[int, int]],
+        max_size: Optional[int]
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Size to shrink a subject to so the finished canvas fits within max_size.
+
+        Shared with the render budget check (limits.fit_size), so the
+        estimate and the render always agree.
+        
+        Args:
+            image_size: Subject dimensions (width, height)
+            target_aspect_ratio: Optional target aspect ratio (width, height)
+            max_size: Longest side of the output in pixels
+            
+        Returns:
+            New subject dimensions, or None if no resize is needed
+        """
+        return fit_size(image_size, target_aspect_ratio, max_size)
+
+    def render_bytes(
+        self,
+        image_bytes: bytes,
+        background_color: Tuple[int, int, int],
+        target_aspect_ratio: Optional[Tuple[int, int]] = None,
+        sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None,
+        output_format: str = "PNG",
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None,
+        mask: Optional[bytes] = None
+    ) -> bytes:
+        """
+        Add background to an encoded image without touching the filesystem.
         
-        if orig_ratio > target_ratio:
-            # Image is too wide, increase height
-            target_h = int(iw / target_ratio)
-            return iw, target_h
+        Args:
+            image_bytes: Encoded segmented image (RGBA PNG), or the original
+                image when ``mask`` is given
+            background_color: RGB background color tuple
+            target_aspect_ratio: Optional target aspect ratio (width, height)
+            sharpen_method: Optional sharpening method to apply
+            output_format: Pillow format name for the encoded result
+            encode_options: Encoder options, see encoding.save_options
+            max_size: Optional longest side of the output in pixels
+            mask: Serialised AlphaMask of ``image_bytes``
+            
+        Returns:
+            Encoded output image bytes
+        """
+        data, _ = self.render_variants(image_bytes, [{
+            "background_color": background_color,
+            "aspect_ratio": target_aspect_ratio,
+            "sharpen_method": sharpen_method,
+            "output_format": output_format,
+            "encode_options": encode_options,
+            "max_size": max_size
+        }], mask)[0]
+        return data
+
+    def render_variants(
+        self, image_bytes: bytes, variants: List[Dict], mask: Optional[bytes] = None
+    ) -> List[Tuple[bytes, float]]:
+        """
+        Render several output variants from one segmented image.
+        
+        The image is decoded and converted to RGBA once; sharpened and
+        resized copies of the subject are shared by all variants that ask
+        for the same sharpen method and size. When every variant is shrunk
+        by ``max_size``, a JPEG original is decoded at the smallest DCT
+        scale that covers them all (see limits.decode_target) and resampled
+        once to each output size.
+        
+        Args:
+            image_bytes: Encoded segmented image (RGBA PNG), or the original
+                image when ``mask`` is given
+            variants: Output specs, each a dict with optional keys
+                ``background_color``, ``aspect_ratio``, ``sharpen_method``,
+                ``output_format``, ``encode_options`` (see
+                encoding.save_options) and ``max_size`` (longest side of
+                the output in pixels)
+            mask: Serialised AlphaMask of ``image_bytes``, applied to its pixels
+            
+        Returns:
+            (encoded bytes, encode seconds) per variant, in the order of ``variants``
+        """
+        if mask is not None:
+            with Image.open(BytesIO(image_bytes)) as image:
+                source_size = image.size
+            source = apply_mask(image_bytes, mask, decode_target(source_size, variants))
         else:
-            # Image is too tall, increase width
-            target_w = int(ih * target_ratio)
-            return target_w, ih
+            with Image.open(BytesIO(image_bytes)) as image:
+                source = image.convert("RGBA")
+            source_size = source.size
+        
+        sharpened: Dict[Optional[str], Image.Image] = {None: source}
+        resized: Dict[Tuple[Optional[str], Tuple[int, int]], Image.Image] = {}
+        outputs = []
+        for variant in variants:
+            sharpen_method = variant.get("sharpen_method")
+            if sharpen_method not in sharpened:
+                sharpened[sharpen_method] = self.sharpen_image(source, method=sharpen_method)
+            subject = sharpened[sharpen_method]
+            
+            aspect_ratio = variant.get("aspect_ratio")
+            target_aspect_ratio = tuple(aspect_ratio) if aspect_ratio else None
+            # Sized from the source, which a reduced decode only approximates
+            size = self.fit_size(source_size, target_aspect_ratio, variant.get("max_size"))
+            if size is not None and size != subject.size:
+                key = (sharpen_method, size)
+                if key not in resized:
+                    resized[key] = subject.resize(size, Image.LANCZOS)
+                subject = resized[key]
+            
+            background_color = tuple(variant.get("background_color") or (255, 255, 255))
+            output_format = variant.get("output_format") or "PNG"
+            size = self.canvas_size(subject.size, target_aspect_ratio)
+            if uses_tiles(size):
+                logger.info(f"Compositing {size[0]}x{size[1]} canvas in strips")
+                outputs.append(render_tiled(
+                    subject, background_color, size, output_format, variant.get("encode_options"), settings.TILE_ROWS
+                ))
+                continue
+            final_image = self.compose(subject, background_color, target_aspect_ratio)
+            outputs.append(encode_image(final_image, output_format, variant.get("encode_options")))
+        return outputs
 
     def add_background(
         self,
@@ -76,59 +267,151 @@ class BackgroundProcessor:
         background_color: Tuple[int, int, int],
         output_path: str,
         target_aspect_ratio: Optional[Tuple[int, int]] = None,
-        sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None
-    ) -> None:
+        sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None,
+        encode_options: Optional[Dict] = None,
+        max_size: Optional[int] = None,
+        mask_path: Optional[str] = None,
+        output_format: Optional[str] = None
+    ) -> Tuple[int, float]:
         """
         Add background to image and optionally adjust aspect ratio.
         
         Args:
-            image_path: Path to input image
+            image_path: Path to input image: a segmented RGBA image, or the
+                original when ``mask_path`` is given
             background_color: RGB background color tuple
             output_path: Path to save output image
             target_aspect_ratio: Optional target aspect ratio (width, height)
             sharpen_method: Optional sharpening method to apply
+            encode_options: Encoder options, see encoding.save_options
+            max_size: Optional longest side of the output in pixels
+            mask_path: Path to the image's AlphaMask, see segment_image
+            output_format: Pillow format name; defaults to the one implied by
+                the extension of ``output_path``
+            
+        Returns:
+            Tuple of (bytes written, encode seconds); for outputs composited
+            in strips the encode time includes compositing, as in render_variants
             
         Raises:
             ValueError: If invalid parameters are provided
         """
         try:
-            # Open and convert image to RGBA
-            image = Image.open(image_path).convert("RGBA")
-            
-            # Apply sharpening if method specified
-            if sharpen_method:
-                image = self.sharpen_image(image, method=sharpen_method)
-            
-            if not target_aspect_ratio:
-                logger.info("No target aspect ratio set, using original size")
-                background = Image.new("RGBA", image.size, background_color)
-                background.paste(image, (0, 0), image)
+            with Image.open(image_path) as image:
+                source_size = image.size
+            target = decode_target(source_size, [{"aspect_ratio": target_aspect_ratio, "max_size": max_size}])
+            if mask_path:
+                with open(image_path, "rb") as f:
+                    image_bytes = f.read()
+                with open(mask_path, "rb") as f:
+                    mask = f.read()
+                source = apply_mask(image_bytes, mask, target)
             else:
-                # Calculate target dimensions
-                target_ratio = target_aspect_ratio[0] / target_aspect_ratio[1]
-                target_w, target_h = self.calculate_target_dimensions(image.size, target_ratio)
-                
-                logger.info(f"Original ratio: {image.size[0]/image.size[1]:.2f}, "
-                          f"Target ratio: {target_ratio:.2f}")
-                
-                # Create new background with target dimensions
-                background = Image.new("RGBA", (target_w, target_h), background_color)
-                
-                # Calculate centering coordinates
-                x = (target_w - image.size[0]) // 2
-                y = (target_h - image.size[1]) // 2
-                
-                background.paste(image, (x, y), image)
+                source = Image.open(image_path)
+                if target is not None:
+                    source.draft("RGB", target)
+            with source as image:
+                size = self.fit_size(source_size, target_aspect_ratio, max_size)
+                if size is not None and size != image.size:
+                    image = image.convert("RGBA").resize(size, Image.LANCZOS)
+                output_format = output_format or format_for_path(output_path)
+                size = self.canvas_size(image.size, target_aspect_ratio)
+                if uses_tiles(size) and output_format in MIME_TYPES:
+                    subject = image.convert("RGBA")
+                    if sharpen_method:
+                        subject = self.sharpen_image(subject, method=sharpen_method)
+                    data, encode_seconds = render_tiled(
+                        subject, background_color, size, output_format, encode_options, settings.TILE_ROWS
+                    )
+                    with open(output_path, "wb") as f:
+                        f.write(data)
+                    logger.info(f"Image saved successfully to {output_path}")
+                    return len(data), encode_seconds
+                final_image = self.compose(image, background_color, target_aspect_ratio, sharpen_method)
             print(f"save image to {output_path}")
-            # Convert to RGB and save
-            final_image = background.convert("RGB")
-            final_image.save(output_path)
+            options = save_options(output_format, **(encode_options or {})) if output_format in MIME_TYPES else {}
+            start = time.perf_counter()
+            prepare_for_save(final_image, output_format).save(output_path, format=output_format, **options)
+            encode_seconds = time.perf_counter() - start
             logger.info(f"Image saved successfully to {output_path}")
+            return os.path.getsize(output_path), encode_seconds
             
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise
 
+_processor: Optional[BackgroundProcessor] = None
+
+def _get_processor() -> BackgroundProcessor:
+    """Per-process BackgroundProcessor used by pool workers"""
+    global _processor
+    if _processor is None:
+        _processor = BackgroundProcessor()
+    return _processor
+
+def render_background(
+    image_bytes: bytes,
+    background_color: Tuple[int, int, int],
+    target_aspect_ratio: Optional[Tuple[int, int]] = None,
+    sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None,
+    output_format: str = "PNG",
+    encode_options: Optional[Dict] = None,
+    max_size: Optional[int] = None,
+    mask: Optional[bytes] = None
+) -> bytes:
+    """Picklable entry point for BackgroundProcessor.render_bytes"""
+    return _get_processor().render_bytes(
+        image_bytes, background_color, target_aspect_ratio, sharpen_method, output_format, encode_options, max_size,
+        mask
+    )
+
+def render_background_variants(
+    image_bytes: bytes, variants: List[Dict], mask: Optional[bytes] = None
+) -> List[Tuple[bytes, float]]:
+    """Picklable entry point for BackgroundProcessor.render_variants"""
+    return _get_processor().render_variants(image_bytes, variants, mask)
+
+def add_background_file(
+    image_path: str,
+    background_color: Tuple[int, int, int],
+    output_path: str,
+    target_aspect_ratio: Optional[Tuple[int, int]] = None,
+    sharpen_method: Optional[Literal['sharpen', 'unsharp']] = None,
+    encode_options: Optional[Dict] = None,
+    max_size: Optional[int] = None,
+    mask_path: Optional[str] = None,
+    output_format: Optional[str] = None
+) -> Tuple[int, float]:
+    """Picklable entry point for BackgroundProcessor.add_background"""
+    return _get_processor().add_background(
+        image_path, background_color, output_path, target_aspect_ratio, sharpen_method, encode_options, max_size,
+        mask_path, output_format
+    )
+
+def warm_up() -> List[str]:
+    """
+    Picklable warm-up job for compositing workers.
+
+    Loads all Pillow plugins and renders a tiny image in every available
+    output format, so the first real request does not pay for plugin
+    imports, codec initialisation or the compositing engine's setup.
+
+    Returns:
+        Output formats that encoded successfully
+    """
+    Image.init()
+    buffer = BytesIO()
+    Image.new("RGBA", (8, 8), (255, 0, 0, 128)).save(buffer, format="PNG")
+    formats = []
+    for output_format in MIME_TYPES:
+        try:
+            render_background(buffer.getvalue(), (255, 255, 255), (1, 1), output_format=output_format)
+        except (ValueError, OSError):
+            # e.g. no AVIF encoder in this Pillow build
+            continue
+        formats.append(output_format)
+    return formats
+
 def main():
     """Example usage of BackgroundProcessor"""
     processor = BackgroundProcessor()
@@ -136,7 +419,8 @@ def main():
     # Example configurations
     test_configs = [
         {
-            "image_path": os.path.join(base_path, "tt18_segmented.png"),
+            "image_path": os.path.join(project_root, "input-images", "tt18.jpg"),
+            "mask_path": os.path.join(base_path, "tt18_segmented.amask"),
             "background_color": (255, 255, 255),
             "output_path": os.path.join(base_path, "tt18_segmented_white_bg_9_16.jpg"),
             "target_aspect_ratio": (9, 16)
@@ -150,7 +434,8 @@ def main():
             background_color=config["background_color"],
             output_path=config["output_path"],
             target_aspect_ratio=config["target_aspect_ratio"],
-            sharpen_method='unsharp'
+            sharpen_method='unsharp',
+            mask_path=config["mask_path"]
         )
 
 if __name__ == "__main__":
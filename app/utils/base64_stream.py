@@ -0,0 +1,142 @@
+import binascii
+from typing import Optional, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# Characters decoded per step; a multiple of 4 so every chunk holds whole quanta
+DECODE_CHUNK = 1 << 20
+# Bytes encoded per step; a multiple of 3 so only the last chunk is padded
+ENCODE_CHUNK = 3 << 18
+# A data URL header ("data:image/png;base64,") must end within this many characters
+MAX_HEADER = 256
+
+_JSON_WHITESPACE = b" \t\r\n"
+
+
+def payload_start(value: Union[str, BytesLike]) -> int:
+    """Offset of the base64 payload in ``value``, past a data URL header if there is one"""
+    if isinstance(value, str):
+        comma = value.find(",", 0, MAX_HEADER)
+    else:
+        comma = bytes(value[:MAX_HEADER]).find(b",")
+    return comma + 1
+
+
+def _decode_chunked(value: Union[str, memoryview], start: int) -> Union[bytes, bytearray]:
+    length = len(value) - start
+    if length % 4 or (isinstance(value, str) and not value.isascii()):
+        # Unpadded or wrapped input: quanta do not line up with chunks
+        return binascii.a2b_base64(value[start:])
+    tail = value[-2:] if isinstance(value, str) else bytes(value[-2:]).decode("latin-1")
+    padding = tail.endswith("=") + tail.endswith("==")
+    decoded = bytearray(length // 4 * 3 - padding)
+    position = 0
+    with memoryview(decoded) as view:
+        try:
+            for offset in range(start, len(value), DECODE_CHUNK):
+                chunk = binascii.a2b_base64(value[offset:offset + DECODE_CHUNK])
+                view[position:position + len(chunk)] = chunk
+                position += len(chunk)
+        except (binascii.Error, ValueError):
+            position = -1
+    if position != len(decoded):
+        # Embedded whitespace shifted the quanta; decode in one go instead
+        return binascii.a2b_base64(value[start:])
+    return decoded
+
+
+def decode_base64(value: Union[str, BytesLike]) -> Union[bytes, bytearray]:
+    """
+    Decode base64 or a base64 data URL without copying the encoded input.
+
+    The payload is decoded in DECODE_CHUNK pieces into one preallocated
+    buffer: bytes-like input through a memoryview, so nothing is copied,
+    and a ``str`` without ever materialising the stripped payload or its
+    ASCII encoding. Working in chunks also lets other threads, such as the
+    event loop, run between them. Characters outside the alphabet are
+    ignored, as with ``base64.b64decode``.
+
+    Args:
+        value: Base64 text, optionally with a ``data:<mime>;base64,`` header
+
+    Returns:
+        Decoded bytes or bytearray
+
+    Raises:
+        binascii.Error: If the payload is not valid base64
+        ValueError: If a ``str`` payload contains non-ASCII characters
+    """
+    if isinstance(value, str):
+        return _decode_chunked(value, payload_start(value))
+    with memoryview(value) as view:
+        return _decode_chunked(view, payload_start(view))
+
+
+def encode_base64(data: BytesLike, prefix: bytes = b"", suffix: bytes = b"") -> bytearray:
+    """
+    Base64-encode ``data`` between ``prefix`` and ``suffix`` in a single buffer.
+
+    The output is sized up front and filled ENCODE_CHUNK input bytes at a
+    time, so the only full-size allocation is the result itself.
+
+    Args:
+        data: Bytes to encode
+        prefix: Written before the encoded data, e.g. the start of a JSON document
+        suffix: Written after the encoded data
+
+    Returns:
+        prefix + base64(data) + suffix
+    """
+    with memoryview(data) as source:
+        size = source.nbytes
+        encoded = bytearray(len(prefix) + (size + 2) // 3 * 4 + len(suffix))
+        position = len(prefix)
+        with memoryview(encoded) as view:
+            view[:position] = prefix
+            for offset in range(0, size, ENCODE_CHUNK):
+                chunk = binascii.b2a_base64(source[offset:offset + ENCODE_CHUNK], newline=False)
+                view[position:position + len(chunk)] = chunk
+                position += len(chunk)
+            view[position:] = suffix
+    return encoded
+
+
+def encode_data_url(data: BytesLike, mime_type: str) -> str:
+    """``data:<mime_type>;base64,...`` for ``data``, built with one intermediate buffer"""
+    return encode_base64(data, f"data:{mime_type};base64,".encode("ascii")).decode("ascii")
+
+
+def json_string_field(body: Union[bytes, bytearray], name: str) -> Optional[memoryview]:
+    """
+    Find a string member in a JSON document without parsing the document.
+
+    Meant for large values such as base64 images: the result is a view of
+    the raw characters inside ``body``. Only the first ``"name":`` key is
+    considered, wherever it is nested.
+
+    Args:
+        body: Raw JSON document
+        name: Member name
+
+    Returns:
+        View of the string value, or None if the member is missing, is not a
+        string or contains escape sequences; parse with ``json.loads`` then
+    """
+    key = b'"' + name.encode("utf-8") + b'"'
+    index = body.find(key)
+    if index < 0 or (index > 0 and body[index - 1] == ord("\\")):
+        return None
+    position = index + len(key)
+    while position < len(body) and body[position] in _JSON_WHITESPACE:
+        position += 1
+    if body[position:position + 1] != b":":
+        return None
+    position += 1
+    while position < len(body) and body[position] in _JSON_WHITESPACE:
+        position += 1
+    if body[position:position + 1] != b'"':
+        return None
+    end = body.find(b'"', position + 1)
+    if end < 0 or body.find(b"\\", position + 1, end) >= 0:
+        return None
+    return memoryview(body)[position + 1:end]
@@ -0,0 +1,277 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.utils.alpha_mask import MASK_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryLRU:
+    """In-memory LRU mapping of str keys to bytes, bounded by total byte size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._items[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+
+class DiskStore:
+    """
+    On-disk tier storing one file per key, bounded by total byte size.
+
+    Files are evicted least-recently-used first; access order survives
+    restarts through file modification times.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.current_bytes = 0
+        self.evictions = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU index from files left by a previous run"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.current_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError as e:
+                logger.warning(f"Failed to evict cache file {key}: {str(e)}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self.current_bytes -= size
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old
+            self._index[key] = size
+            self.current_bytes += size
+            self._evict()
+
+
+class SegmentationCache:
+    """
+    Content-addressed cache of segmentation results.
+
+    Keys are SHA-256 digests of the input image bytes, values are the
+    serialised alpha masks of their segmentations (see alpha_mask). Lookups
+    check the in-memory LRU tier first, then the optional disk tier.
+    """
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str] = None, disk_bytes: int = 0):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskStore(disk_dir, disk_bytes, suffix=MASK_EXTENSION) if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.hits += 1
+                self.disk_hits += 1
+                self.memory.put(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except OSError as e:
+                logger.warning(f"Failed to write segmentation cache entry: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        stats = {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_evictions": self.memory.evictions,
+        }
+        if self.disk is not None:
+            stats.update({
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk.current_bytes,
+                "disk_evictions": self.disk.evictions,
+            })
+        return stats
+
+
+class OutputCache:
+    """
+    In-memory cache of encoded output images.
+
+    Keys are digests of the input image bytes together with every render
+    parameter that affects the output, so a key also serves as a strong
+    ETag for the response.
+    """
+
+    def __init__(self, memory_bytes: int):
+        self.memory = MemoryLRU(memory_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(image_bytes: bytes, params: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        encoded = json.dumps([digest, params], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        self.memory.put(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_evictions": self.memory.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key.
+
+    The first caller starts the work as a task; callers arriving while it
+    runs await the same task. The task is shielded, so a caller that goes
+    away (e.g. a disconnected client) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run ``fn`` unless a call with the same key is already in flight.
+
+        Returns:
+            Tuple of (result, whether it was shared with an earlier caller)
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
@@ -0,0 +1,112 @@
+import time
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+# Pillow is imported on first use, so the API routes import without it
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Formats that can encode the RGBX images produced by the NumPy engine as-is
+RGBX_FORMATS = ('JPEG', 'WEBP', 'TIFF')
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "AVIF": "image/avif"}
+EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "AVIF": "avif"}
+
+# Request options understood by save_options
+ENCODE_OPTION_KEYS = ("preset", "quality", "compress_level", "subsampling", "progressive", "optimize")
+
+# Pillow save() arguments per preset and format; explicit request options win.
+# "fast" trades size for encode speed, "small" minimizes bytes for CDN delivery.
+ENCODE_PRESETS = {
+    "default": {},
+    "fast": {
+        "PNG": {"compress_level": 1},
+        "JPEG": {"quality": 85, "subsampling": "4:2:0"},
+        "WEBP": {"quality": 80, "method": 0},
+        "AVIF": {"quality": 60, "speed": 10},
+    },
+    "small": {
+        "PNG": {"optimize": True},
+        "JPEG": {"quality": 78, "subsampling": "4:2:0", "optimize": True, "progressive": True},
+        "WEBP": {"quality": 75, "method": 6},
+        "AVIF": {"quality": 50, "speed": 4},
+    },
+}
+
+def prepare_for_save(image: "Image.Image", output_format: Optional[str]) -> "Image.Image":
+    """Convert RGBX compositing output to RGB when the encoder cannot take it"""
+    if image.mode == "RGBX" and (output_format or "").upper() not in RGBX_FORMATS:
+        return image.convert("RGB")
+    return image
+
+def save_options(
+    output_format: str,
+    preset: Optional[str] = None,
+    quality: Optional[int] = None,
+    compress_level: Optional[int] = None,
+    subsampling: Optional[str] = None,
+    progressive: Optional[bool] = None,
+    optimize: Optional[bool] = None
+) -> Dict:
+    """
+    Build Pillow save() arguments for an output format.
+
+    Options that do not apply to the format (e.g. quality for PNG) are
+    ignored.
+
+    Args:
+        output_format: Pillow format name (PNG, JPEG, WEBP or AVIF)
+        preset: "default", "fast" or "small"
+        quality: JPEG/WebP/AVIF quality (1-100)
+        compress_level: PNG zlib level (0-9)
+        subsampling: JPEG/AVIF chroma subsampling ("4:4:4", "4:2:2", "4:2:0")
+        progressive: Write progressive JPEG
+        optimize: Extra encoder pass for smaller PNG/JPEG output
+
+    Returns:
+        Keyword arguments for Image.save
+
+    Raises:
+        ValueError: If the format or preset is not supported
+    """
+    output_format = output_format.upper()
+    if output_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if output_format == "AVIF":
+        from PIL import features
+        if not features.check("avif"):
+            raise ValueError("AVIF encoding is not available in this Pillow build")
+    if (preset or "default") not in ENCODE_PRESETS:
+        raise ValueError(f"Unsupported encode preset: {preset}")
+
+    options = dict(ENCODE_PRESETS[preset or "default"].get(output_format, {}))
+    if quality is not None and output_format in ("JPEG", "WEBP", "AVIF"):
+        options["quality"] = quality
+    if compress_level is not None and output_format == "PNG":
+        options["compress_level"] = compress_level
+    if subsampling is not None and output_format in ("JPEG", "AVIF"):
+        options["subsampling"] = subsampling
+    if progressive is not None and output_format == "JPEG":
+        options["progressive"] = progressive
+    if optimize is not None and output_format in ("PNG", "JPEG"):
+        options["optimize"] = optimize
+    return options
+
+def encode_image(image: "Image.Image", output_format: str, options: Optional[Dict] = None) -> Tuple[bytes, float]:
+    """
+    Encode an image in memory.
+
+    Args:
+        image: Composited image (RGB or RGBX)
+        output_format: Pillow format name
+        options: Request encode options (keys of ENCODE_OPTION_KEYS)
+
+    Returns:
+        Tuple of (encoded bytes, encode time in seconds)
+    """
+    output_format = output_format.upper()
+    kwargs = save_options(output_format, **(options or {}))
+    start = time.perf_counter()
+    buffer = BytesIO()
+    prepare_for_save(image, output_format).save(buffer, format=output_format, **kwargs)
+    return buffer.getvalue(), time.perf_counter() - start
@@ -0,0 +1,122 @@
+import math
+import asyncio
+import logging
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Literal, Optional, TypeVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ExecutorBusyError(Exception):
+    """Raised when a bounded executor has no room for another job"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+async def retry_when_busy(call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+    """
+    Await ``call()``, retrying for as long as it raises ExecutorBusyError.
+
+    For background work (batch items, jobs, ingest) that should wait for
+    capacity rather than fail. Between attempts it sleeps for the error's
+    retry_after, capped at a second so freed capacity is picked up quickly.
+
+    Args:
+        call: Zero-argument function returning a fresh awaitable per attempt
+        timeout: Seconds to keep retrying; None retries indefinitely
+
+    Raises:
+        ExecutorBusyError: The last rejection, once ``timeout`` has passed
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    while True:
+        try:
+            return await call()
+        except ExecutorBusyError as e:
+            delay = min(e.retry_after, 1)
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+
+
+class CompositingExecutor:
+    """
+    Bounded thread or process pool for CPU-bound compositing and encoding.
+
+    At most ``max_workers`` jobs run at once and at most ``queue_size``
+    more wait for a worker; anything beyond that is rejected immediately
+    with ExecutorBusyError instead of queueing without limit.
+    """
+
+    def __init__(
+        self,
+        kind: Literal['thread', 'process'] = 'thread',
+        max_workers: int = 4,
+        queue_size: int = 16
+    ):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unsupported executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self._avg_duration = 0.0
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=max_workers) if kind == 'process'
+            else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compositing")
+        )
+
+    @classmethod
+    def from_settings(cls) -> "CompositingExecutor":
+        return cls(
+            kind=settings.COMPOSITE_EXECUTOR,
+            max_workers=settings.COMPOSITE_WORKERS,
+            queue_size=settings.COMPOSITE_QUEUE_SIZE
+        )
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_size
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a slot frees up from the average job time"""
+        waves = self.pending / self.max_workers
+        return max(1, math.ceil(waves * self._avg_duration))
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run ``fn(*args, **kwargs)`` in the pool and await its result.
+
+        Raises:
+            ExecutorBusyError: If all workers are busy and the queue is full
+        """
+        if self.pending >= self.capacity:
+            raise ExecutorBusyError(
+                f"Compositing queue is full ({self.pending}/{self.capacity})",
+                retry_after=self._retry_after()
+            )
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        start = loop.time()
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            duration = loop.time() - start
+            self._avg_duration = duration if not self._avg_duration else 0.8 * self._avg_duration + 0.2 * duration
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
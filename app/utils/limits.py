@@ -0,0 +1,175 @@
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+# Memory an encoder allocates beyond the RGB image it is given (YUV planes,
+# analysis buffers), per output pixel; measured with Pillow on noisy content.
+# PNG and JPEG encode row by row from their input.
+ENCODER_BYTES_PER_PIXEL = {"WEBP": 20, "AVIF": 24}
+
+
+class ImageTooLargeError(Exception):
+    """Raised when a request would exceed the pixel or memory budget"""
+
+
+def probe_image(source) -> Tuple[Tuple[int, int], Optional[str]]:
+    """
+    Read image dimensions and format from the header only, without decoding pixels.
+
+    Args:
+        source: Encoded image bytes or a file path
+
+    Returns:
+        ((width, height), Pillow format name)
+
+    Raises:
+        ImageTooLargeError: If Pillow refuses the header as a decompression bomb
+    """
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    try:
+        with Image.open(source) as image:
+            return image.size, image.format
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+
+
+def target_dimensions(image_size: Tuple[int, int], target_ratio: float) -> Tuple[int, int]:
+    """Smallest canvas with aspect ratio ``target_ratio`` (width/height) that holds ``image_size``"""
+    width, height = image_size
+    if width / height > target_ratio:
+        # Image is too wide, increase height
+        return width, int(width / target_ratio)
+    # Image is too tall, increase width
+    return int(height * target_ratio), height
+
+
+def canvas_size(image_size: Tuple[int, int], aspect_ratio: Optional[Sequence[int]]) -> Tuple[int, int]:
+    """Dimensions of the composited output for a subject of ``image_size``"""
+    if not aspect_ratio:
+        return image_size
+    return target_dimensions(image_size, aspect_ratio[0] / aspect_ratio[1])
+
+
+def fit_size(
+    image_size: Tuple[int, int], aspect_ratio: Optional[Sequence[int]], max_size: Optional[int]
+) -> Optional[Tuple[int, int]]:
+    """Size to shrink a subject to so its canvas fits within ``max_size``, or None if no resize is needed"""
+    if not max_size:
+        return None
+    scale = max_size / max(canvas_size(image_size, aspect_ratio))
+    if scale >= 1:
+        return None
+    return max(1, round(image_size[0] * scale)), max(1, round(image_size[1] * scale))
+
+
+def output_size(
+    image_size: Tuple[int, int], aspect_ratio: Optional[Sequence[int]], max_size: Optional[int]
+) -> Tuple[int, int]:
+    """Dimensions of the finished output for an input of ``image_size``"""
+    return canvas_size(fit_size(image_size, aspect_ratio, max_size) or image_size, aspect_ratio)
+
+
+def decode_target(image_size: Tuple[int, int], variants: List[Dict]) -> Optional[Tuple[int, int]]:
+    """
+    Smallest subject size that still serves every variant.
+
+    The largest size fit_size shrinks the subject to for any variant, or
+    None when one of them needs the input at full resolution (or
+    REDUCED_DECODE_ENABLED is off).
+    """
+    if not settings.REDUCED_DECODE_ENABLED or not variants:
+        return None
+    width = height = 0
+    for variant in variants:
+        size = fit_size(image_size, variant.get("aspect_ratio"), variant.get("max_size"))
+        if size is None:
+            return None
+        width = max(width, size[0])
+        height = max(height, size[1])
+    return width, height
+
+
+def draft_size(image_size: Tuple[int, int], image_format: Optional[str], target: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """
+    Dimensions an image decodes at when drafted to ``target`` (``Image.draft``).
+
+    JPEG is decoded at the smallest DCT scale of 1/2, 1/4 or 1/8 that is
+    still at least ``target``; other formats always decode in full.
+    """
+    if image_format != "JPEG" or target is None:
+        return image_size
+    ratio = min(image_size[0] // target[0], image_size[1] // target[1])
+    scale = next((s for s in (8, 4, 2) if ratio >= s), 1)
+    return (image_size[0] + scale - 1) // scale, (image_size[1] + scale - 1) // scale
+
+
+def uses_tiles(size: Tuple[int, int]) -> bool:
+    """Whether a canvas is large enough to be composited in strips"""
+    return size[0] * size[1] >= settings.TILED_COMPOSITE_PIXELS
+
+
+def estimate_render_bytes(image_size: Tuple[int, int], size: Tuple[int, int], output_format: str) -> int:
+    """
+    Rough peak memory of compositing one output.
+
+    The decoded RGBA subject (``image_size``, as decoded) is always held. Whole-canvas compositing holds
+    an RGBA canvas plus its RGB copy; in tiled mode only one strip is live
+    when the output is PNG (streamed row by row), while other encoders need
+    the assembled RGB canvas. WebP and AVIF encoders also allocate their own
+    working buffers (ENCODER_BYTES_PER_PIXEL) on top of the canvas.
+    """
+    output_format = (output_format or "PNG").upper()
+    subject = 4 * image_size[0] * image_size[1]
+    encoder = ENCODER_BYTES_PER_PIXEL.get(output_format, 0) * size[0] * size[1]
+    if not uses_tiles(size):
+        return subject + 7 * size[0] * size[1] + encoder
+    strip = 7 * size[0] * settings.TILE_ROWS
+    if output_format == "PNG":
+        return subject + strip
+    return subject + strip + 3 * size[0] * size[1] + encoder
+
+
+def check_render_budget(
+    image_size: Tuple[int, int], variants: List[Dict], image_format: Optional[str] = None
+) -> int:
+    """
+    Reject a request before any decoding if it would exceed the budgets.
+
+    Args:
+        image_size: Input dimensions, from probe_image
+        variants: Output specs, see BackgroundProcessor.render_variants
+        image_format: Input format, from probe_image; JPEG inputs may be
+            decoded at reduced scale (see decode_target)
+
+    Returns:
+        Largest estimated peak memory of the variants, in bytes
+
+    Raises:
+        ImageTooLargeError: If the input, a canvas or the estimated memory
+            is over its limit
+    """
+    width, height = image_size
+    decoded = draft_size(image_size, image_format, decode_target(image_size, variants))
+    peak = 0
+    if width * height > settings.MAX_INPUT_PIXELS:
+        raise ImageTooLargeError(
+            f"Input image is {width}x{height}, more than {settings.MAX_INPUT_PIXELS} pixels"
+        )
+    for variant in variants:
+        size = output_size(image_size, variant.get("aspect_ratio"), variant.get("max_size"))
+        if size[0] * size[1] > settings.MAX_CANVAS_PIXELS:
+            raise ImageTooLargeError(
+                f"Output canvas would be {size[0]}x{size[1]}, more than {settings.MAX_CANVAS_PIXELS} pixels; "
+                f"use max_size to limit it"
+            )
+        needed = estimate_render_bytes(decoded, size, variant.get("output_format"))
+        if needed > settings.RENDER_MEMORY_BUDGET_BYTES:
+            raise ImageTooLargeError(
+                f"Rendering a {size[0]}x{size[1]} {variant.get('output_format') or 'PNG'} would need about "
+                f"{needed // (1024 * 1024)}MB, over the {settings.RENDER_MEMORY_BUDGET_BYTES // (1024 * 1024)}MB budget"
+            )
+        peak = max(peak, needed)
+    return peak
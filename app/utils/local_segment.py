@@ -0,0 +1,143 @@
+import io
+import logging
+from typing import Optional, Tuple, Union
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.utils.alpha_mask import encode_mask
+
+logger = logging.getLogger(__name__)
+
+# Width of the border band used to estimate the backdrop, as a share of the shorter side
+BORDER_BAND = 0.02
+# A fill that covers less or more of the image than this did not find a subject
+MIN_BACKGROUND_SHARE = 0.05
+MAX_BACKGROUND_SHARE = 0.98
+# Row/column passes of the border fill; each pass follows one turn of a path
+MAX_FILL_PASSES = 64
+
+
+def estimate_backdrop(pixels: np.ndarray, tolerance: float) -> Tuple[np.ndarray, float]:
+    """
+    Estimate the backdrop color from the image border.
+
+    Args:
+        pixels: HxWx3 uint8 array
+        tolerance: RGB distance within which a pixel matches the backdrop
+
+    Returns:
+        (median border color as int32 array, share of border pixels within
+        ``tolerance`` of it), the latter being the uniformity confidence
+    """
+    height, width = pixels.shape[:2]
+    band = max(1, round(min(height, width) * BORDER_BAND))
+    border = np.concatenate([
+        pixels[:band].reshape(-1, 3),
+        pixels[-band:].reshape(-1, 3),
+        pixels[band:-band, :band].reshape(-1, 3),
+        pixels[band:-band, -band:].reshape(-1, 3),
+    ])
+    color = np.median(border, axis=0).astype(np.int32)
+    distance = ((border.astype(np.int32) - color) ** 2).sum(axis=1)
+    return color, float((distance <= tolerance * tolerance).mean())
+
+
+def _spread_runs(reached: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Extend ``reached`` to every horizontal run of ``candidate`` pixels it touches"""
+    height, width = candidate.shape
+    flat = candidate.ravel()
+    # A new run id starts at every non-candidate pixel and at every row start
+    starts = ~flat
+    starts[::width] = True
+    run_id = np.cumsum(starts)
+    hit = np.zeros(run_id[-1] + 1, dtype=bool)
+    hit[run_id[reached.ravel()]] = True
+    return (hit[run_id] & flat).reshape(height, width)
+
+
+def fill_from_border(candidate: np.ndarray) -> np.ndarray:
+    """
+    Flood fill: the ``candidate`` pixels 4-connected to the image border.
+
+    Alternates whole-run propagation along rows and columns until nothing
+    changes, which takes one pass per turn of the longest path rather than
+    one per pixel.
+    """
+    reached = np.zeros_like(candidate)
+    reached[[0, -1], :] = candidate[[0, -1], :]
+    reached[:, [0, -1]] = candidate[:, [0, -1]]
+    candidate_t = np.ascontiguousarray(candidate.T)
+    for _ in range(MAX_FILL_PASSES):
+        grown = _spread_runs(reached, candidate)
+        grown = np.ascontiguousarray(_spread_runs(np.ascontiguousarray(grown.T), candidate_t).T)
+        if np.array_equal(grown, reached):
+            break
+        reached = grown
+    return reached
+
+
+def segment_uniform_backdrop(
+    image_bytes: bytes,
+    source_digest: str,
+    tolerance: float = 24.0,
+    feather: float = 1.0,
+    work_side: int = 1024,
+    min_confidence: Optional[float] = None
+) -> Tuple[bool, Union[bytes, str]]:
+    """
+    Cut a subject out of a near-uniform backdrop without the segmentation backend
+
+    The backdrop color is estimated from the border, pixels within
+    ``tolerance`` of it that connect to the border become transparent, and
+    the mask edge is feathered. The mask is computed on a copy reduced to
+    ``work_side`` and upscaled bicubically to the original size; regions of
+    backdrop color enclosed by the subject stay opaque.
+
+    Args:
+        image_bytes: Encoded input image
+        source_digest: SHA-256 hex digest of ``image_bytes``, recorded in the mask
+        tolerance: RGB distance within which a pixel counts as backdrop
+        feather: Gaussian blur radius of the mask edge, in output pixels
+        work_side: Longest side of the copy the mask is computed on
+        min_confidence: Give up unless at least this share of the border
+            matches the backdrop and the fill leaves a plausible subject;
+            None always segments
+
+    Returns:
+        Tuple of (success, serialised AlphaMask or the reason it was not used)
+    """
+    # The working copy is decoded at reduced scale where the format allows
+    # (JPEG draft); only the mask is produced at full size, the RGB pixels
+    # are taken from the original when the mask is applied
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            size = image.size
+            if max(size) > work_side:
+                scale = work_side / max(size)
+                target = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+                image.draft("RGB", target)
+                work = image.convert("RGB").resize(target, Image.BOX)
+            else:
+                work = image.convert("RGB")
+    except Exception as e:
+        return False, f"Failed to decode image: {str(e)}"
+    pixels = np.asarray(work)
+
+    color, confidence = estimate_backdrop(pixels, tolerance)
+    if min_confidence is not None and confidence < min_confidence:
+        return False, f"Backdrop is not uniform (confidence {confidence:.2f})"
+
+    distance = ((pixels.astype(np.int32) - color) ** 2).sum(axis=2)
+    background = fill_from_border(distance <= tolerance * tolerance)
+    share = float(background.mean())
+    if min_confidence is not None and not MIN_BACKGROUND_SHARE <= share <= MAX_BACKGROUND_SHARE:
+        return False, f"No distinct subject found (backdrop covers {share:.0%})"
+
+    alpha = Image.fromarray(np.where(background, 0, 255).astype(np.uint8), "L")
+    if feather > 0:
+        # Blurred at working size, where it is cheap; the radius is in output pixels
+        alpha = alpha.filter(ImageFilter.GaussianBlur(feather * work.width / size[0]))
+    if work.size != size:
+        alpha = alpha.resize(size, Image.BICUBIC)
+    logger.info(f"Segmented locally: backdrop {tuple(color)}, confidence {confidence:.2f}, backdrop {share:.0%}")
+    return True, encode_mask(alpha, source_digest)
@@ -0,0 +1,88 @@
+import io
+import logging
+from typing import Optional, Tuple
+from PIL import Image
+
+from app.utils.alpha_mask import encode_mask
+
+logger = logging.getLogger(__name__)
+
+# Upscaling stretches a soft mask edge by the scale factor; the refinement
+# curve steepens it back, but never by more than this
+MAX_EDGE_GAIN = 4.0
+
+
+def downscale_for_segmentation(
+    image_bytes: bytes,
+    max_side: int,
+    quality: int = 90
+) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+    """
+    Make a reduced copy of an image to send to the segmentation backend
+
+    JPEG inputs are decoded at reduced scale (``Image.draft``), so large
+    photos are never fully decoded just to be shrunk.
+
+    Args:
+        image_bytes: Encoded input image
+        max_side: Longest side of the copy in pixels
+        quality: JPEG quality of the copy
+
+    Returns:
+        (JPEG bytes of the copy, original size), or None when the image
+        already fits within max_side
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        size = image.size
+        if max(size) <= max_side:
+            return None
+        scale = max_side / max(size)
+        target = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        image.draft("RGB", target)
+        small = image.convert("RGB").resize(target, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    small.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), size
+
+
+def _edge_curve(gain: float):
+    """Lookup table that steepens alpha transitions around the midpoint"""
+    return [min(255, max(0, round((value - 127.5) * gain + 127.5))) for value in range(256)]
+
+
+def mask_from_segmented(
+    segmented_bytes: bytes,
+    source_digest: str,
+    size: Optional[Tuple[int, int]] = None,
+    refine: bool = True
+) -> bytes:
+    """
+    Keep only the alpha channel of the backend's result, as a compact mask
+
+    When the backend segmented a reduced copy, the alpha channel is
+    upscaled bicubically to ``size``. With ``refine`` the widened edge band
+    is tightened again with a contrast curve, so the cut-out edge keeps
+    roughly the softness the backend produced instead of growing with the
+    scale factor.
+
+    Args:
+        segmented_bytes: RGBA image returned by the segmentation backend
+        source_digest: SHA-256 hex digest of the original input image
+        size: Original size, if the backend was sent a reduced copy
+        refine: Whether to sharpen the upscaled mask edge
+
+    Returns:
+        Serialised AlphaMask for the original image
+    """
+    with Image.open(io.BytesIO(segmented_bytes)) as segmented:
+        if segmented.mode != "RGBA":
+            segmented = segmented.convert("RGBA")
+        alpha = segmented.getchannel("A")
+
+    if size is not None and size != alpha.size:
+        scale = max(size[0] / alpha.width, size[1] / alpha.height)
+        alpha = alpha.resize(size, Image.BICUBIC)
+        if refine and scale > 1:
+            alpha = alpha.point(_edge_curve(min(scale, MAX_EDGE_GAIN)))
+    return encode_mask(alpha, source_digest)
@@ -1,31 +1,135 @@
 import os
-import base64
-import requests
+import time
+import asyncio
+import hashlib
+import aiohttp
+import json
 import logging
-from typing import Tuple, Optional
-import sys
+from contextlib import nullcontext
+from typing import List, Tuple, Optional, Union
 
-# Add project root to Python path
+# Used by the example in main(); run it as ``python -m app.utils.segment``
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-sys.path.append(project_root)
 
 from app.core.config import settings
+from app.core.metrics import span, BACKEND_ERRORS, HEDGED_REQUESTS, SEGMENTATIONS
+from app.utils.cache import SegmentationCache
+from app.utils.admission import FairLimiter
+from app.utils.alpha_mask import MASK_EXTENSION
+from app.utils.backends import BackendPool, SegmentationBackend
+from app.utils.base64_stream import decode_base64, encode_base64, json_string_field
+from app.utils.local_segment import segment_uniform_backdrop
+from app.utils.mask import downscale_for_segmentation, mask_from_segmented
 
 logger = logging.getLogger(__name__)
 
+SEGMENTATION_ENGINES = ("remote", "local", "auto")
+
 class SegmentationService:
-    def __init__(self):
-        self.api_url = settings.SEGMENTATION_API_URL
-        self.timeout = settings.API_TIMEOUT
+    def __init__(self, limiter: Optional[FairLimiter] = None):
+        self.pool = BackendPool(
+            settings.SEGMENTATION_API_URLS or [settings.SEGMENTATION_API_URL],
+            strategy=settings.SEGMENTATION_BALANCER,
+            health_path=settings.SEGMENTATION_HEALTH_PATH,
+            failure_threshold=settings.SEGMENTATION_CIRCUIT_FAILURES,
+            cooldown=settings.SEGMENTATION_CIRCUIT_COOLDOWN,
+            hedge_percentile=settings.SEGMENTATION_HEDGE_PERCENTILE,
+            hedge_min_samples=settings.SEGMENTATION_HEDGE_MIN_SAMPLES
+        )
+        self._health_task: Optional[asyncio.Task] = None
+        # Admission limit on in-flight backend calls; cache hits bypass it
+        self.limiter = limiter
+        self.timeout = aiohttp.ClientTimeout(
+            total=settings.API_TIMEOUT,
+            connect=settings.SEGMENTATION_CONNECT_TIMEOUT
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
         self._ensure_output_dir()
+        self.cache = self._create_cache()
+
+    def _create_cache(self) -> Optional[SegmentationCache]:
+        """Build the segmentation result cache from settings"""
+        if not settings.SEGMENTATION_CACHE_ENABLED:
+            return None
+        disk_dir = None
+        if settings.SEGMENTATION_CACHE_DISK_ENABLED:
+            disk_dir = os.path.join(settings.OUTPUT_DIR, settings.SEGMENTATION_CACHE_DIR)
+        return SegmentationCache(
+            memory_bytes=settings.SEGMENTATION_CACHE_MEMORY_BYTES,
+            disk_dir=disk_dir,
+            disk_bytes=settings.SEGMENTATION_CACHE_DISK_BYTES
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the shared HTTP session, creating it on first use.
+
+        The session owns a size-bounded keep-alive connection pool, so
+        concurrent requests reuse connections to the segmentation backend
+        instead of opening a new one per image.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=settings.SEGMENTATION_POOL_SIZE,
+                limit_per_host=settings.SEGMENTATION_POOL_PER_HOST,
+                keepalive_timeout=settings.SEGMENTATION_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._session_loop = loop
+        return self._session
+
+    async def start(self) -> None:
+        """Start active health checks of the segmentation backends"""
+        if settings.SEGMENTATION_HEALTH_INTERVAL > 0 and settings.SEGMENTATION_HEALTH_PATH and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def warm_up(self) -> None:
+        """
+        Open SEGMENTATION_WARMUP_CONNECTIONS pooled connections to each
+        backend with concurrent health requests, so the first requests do
+        not pay for TCP setup. Also refreshes each backend's health.
+        """
+        if not settings.SEGMENTATION_HEALTH_PATH:
+            return
+        await asyncio.gather(*(
+            self._check_backend(backend)
+            for backend in self.pool.backends
+            for _ in range(settings.SEGMENTATION_WARMUP_CONNECTIONS)
+        ))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._check_backend(b) for b in self.pool.backends))
+            await asyncio.sleep(settings.SEGMENTATION_HEALTH_INTERVAL)
+
+    async def _check_backend(self, backend: SegmentationBackend) -> None:
+        """Probe a backend; any HTTP answer below 500 counts as alive"""
+        try:
+            timeout = aiohttp.ClientTimeout(total=settings.SEGMENTATION_HEALTH_TIMEOUT)
+            async with self._get_session().get(backend.health_url, timeout=timeout) as response:
+                healthy = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        self.pool.set_health(backend, healthy)
+
+    async def close(self) -> None:
+        """Close the shared HTTP session and its pooled connections"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def _ensure_output_dir(self) -> None:
         """Ensure output directory exists"""
         os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
 
-    def _encode_image_to_base64(self, image_path: str) -> Tuple[bool, str]:
+    def _read_image_bytes(self, image_path: str) -> Tuple[bool, Union[bytes, str]]:
         """
-        Encode image file to base64 string
+        Read image file into memory
         
         Args:
             image_path: Path to the image file
@@ -35,28 +139,25 @@ class SegmentationService:
         """
         try:
             with open(image_path, "rb") as f:
-                image_b64 = base64.b64encode(f.read()).decode("utf-8")
-            logger.info("Image successfully encoded to Base64")
-            return True, image_b64
+                image_bytes = f.read()
+            return True, image_bytes
         except Exception as e:
             error_msg = f"Failed to read image: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
 
-    def _decode_base64_response(self, b64_result: str) -> Tuple[bool, bytes]:
+    def _decode_base64_response(self, b64_result: Union[str, memoryview]) -> Tuple[bool, Union[bytes, str]]:
         """
         Decode base64 response from API
         
         Args:
-            b64_result: Base64 encoded string from API
+            b64_result: Base64 encoded string from API, or a view of it in the response body
             
         Returns:
             Tuple of (success, decoded_bytes)
         """
         try:
-            if ',' in b64_result:
-                b64_result = b64_result.split(',', 1)[1]
-            image_bytes = base64.b64decode(b64_result)
+            image_bytes = decode_base64(b64_result)
             logger.info("Successfully decoded API response")
             return True, image_bytes
         except Exception as e:
@@ -64,13 +165,40 @@ class SegmentationService:
             logger.error(error_msg)
             return False, error_msg
 
+    def _parse_response(self, body: bytes) -> Tuple[bool, Union[str, memoryview]]:
+        """
+        Extract the base64 image from an API response body
+
+        The image is located straight in the body; the document is only
+        parsed if the field is not a plain string.
+
+        Args:
+            body: Raw JSON response body
+
+        Returns:
+            Tuple of (success, base64 result or error message)
+        """
+        try:
+            b64_result = json_string_field(body, "result_base64")
+            if b64_result is None:
+                b64_result = json.loads(body).get("result_base64")
+        except Exception as e:
+            error_msg = f"Failed to process API response: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        if not b64_result:
+            error_msg = "result_base64 field not found in response"
+            logger.error(error_msg)
+            return False, error_msg
+        return True, b64_result
+
     def _save_processed_image(self, image_bytes: bytes, output_path: str) -> Tuple[bool, str]:
         """
-        Save processed image to file
+        Save segmentation result to file
         
         Args:
-            image_bytes: Image data in bytes
-            output_path: Path to save the image
+            image_bytes: Serialised alpha mask
+            output_path: Path to save the mask
             
         Returns:
             Tuple of (success, result)
@@ -78,17 +206,299 @@ class SegmentationService:
         try:
             with open(output_path, "wb") as f:
                 f.write(image_bytes)
-            logger.info(f"Processed image saved to: {output_path}")
+            logger.info(f"Segmentation mask saved to: {output_path}")
             return True, output_path
         except Exception as e:
             error_msg = f"Failed to save processed image: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
 
-    def segment_image(
+    async def segment_bytes(self, image_bytes: bytes, engine: Optional[str] = None) -> Tuple[bool, Union[bytes, str]]:
+        """
+        Process in-memory image bytes through segmentation API
+
+        The result is a compact alpha mask (see alpha_mask.AlphaMask) linked
+        to ``image_bytes`` by its SHA-256 digest, not a cut-out image; apply
+        it to the original with alpha_mask.apply_mask.
+
+        Args:
+            image_bytes: Encoded input image (JPEG, PNG, ...)
+            engine: "remote" (segmentation API), "local" (in-process, for
+                near-uniform backdrops) or "auto" (local when the backdrop
+                looks uniform, remote otherwise); defaults to
+                SEGMENTATION_ENGINE
+
+        Returns:
+            Tuple of (success, serialised AlphaMask or error message)
+
+        Raises:
+            AdmissionRejectedError: If no backend call slot frees up in time
+            ValueError: If the engine is not supported
+        """
+        engine = engine or settings.SEGMENTATION_ENGINE
+        if engine not in SEGMENTATION_ENGINES:
+            raise ValueError(f"Unsupported segmentation engine: {engine}")
+        # The digest links the mask to its source and is the cache key
+        with span("seg_hash"):
+            digest = await asyncio.to_thread(SegmentationCache.key_for, image_bytes)
+        if engine == "local":
+            return await self._segment_local(image_bytes, digest, min_confidence=None)
+
+        # Repeat submissions of the same image skip the backend entirely
+        cache_key = self._cache_key(digest)
+        if self.cache is not None:
+            with span("seg_cache_lookup"):
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"Segmentation cache hit: {digest}")
+                return True, cached
+
+        if engine == "auto":
+            success, result = await self._segment_local(
+                image_bytes, digest, min_confidence=settings.LOCAL_SEGMENTATION_MIN_CONFIDENCE
+            )
+            if success:
+                return True, result
+            logger.info(f"Local segmentation declined, using the backend: {result}")
+
+        async with self.limiter.hold() if self.limiter is not None else nullcontext():
+            if settings.SEGMENTATION_MAX_SIDE > 0:
+                success, result = await self._segment_downscaled(image_bytes, digest)
+            else:
+                success, result = await self._segment_full(image_bytes, digest)
+        if success:
+            SEGMENTATIONS.inc(engine="remote")
+        if success and self.cache is not None:
+            with span("seg_cache_store"):
+                await asyncio.to_thread(self.cache.put, cache_key, result)
+        return success, result
+
+    @staticmethod
+    def _cache_key(digest: str) -> str:
+        """
+        Segmentation cache key for the input with SHA-256 ``digest``.
+
+        Only backend masks are cached, so besides the input the key covers
+        the settings that shape them: a mask made from a downscaled copy or
+        without edge refinement is not served once those settings change.
+        """
+        params = {
+            "engine": "remote",
+            "segmentation_max_side": settings.SEGMENTATION_MAX_SIDE,
+            "segmentation_downscale_quality": settings.SEGMENTATION_DOWNSCALE_QUALITY,
+            "segmentation_mask_refine": settings.SEGMENTATION_MASK_REFINE
+        }
+        encoded = json.dumps([digest, params], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    async def _segment_local(
+        self, image_bytes: bytes, digest: str, min_confidence: Optional[float]
+    ) -> Tuple[bool, Union[bytes, str]]:
+        """Segment in-process, see segment_uniform_backdrop; results are not cached"""
+        with span("seg_local"):
+            success, result = await asyncio.to_thread(
+                segment_uniform_backdrop,
+                image_bytes,
+                digest,
+                tolerance=settings.LOCAL_SEGMENTATION_TOLERANCE,
+                feather=settings.LOCAL_SEGMENTATION_FEATHER,
+                work_side=settings.LOCAL_SEGMENTATION_WORK_SIDE,
+                min_confidence=min_confidence
+            )
+        if success:
+            SEGMENTATIONS.inc(engine="local")
+        return success, result
+
+    async def _segment_full(self, image_bytes: bytes, digest: str) -> Tuple[bool, Union[bytes, str]]:
+        """Segment the image as is and keep the alpha mask of the result"""
+        success, result = await self._request_segmentation(image_bytes)
+        if not success:
+            return False, result
+        return await self._to_mask(result, digest)
+
+    async def _segment_downscaled(self, image_bytes: bytes, digest: str) -> Tuple[bool, Union[bytes, str]]:
+        """
+        Segment a reduced copy and upscale its mask to the original size
+
+        Images no larger than SEGMENTATION_MAX_SIDE are sent unchanged.
+
+        Args:
+            image_bytes: Encoded full resolution input image
+            digest: SHA-256 hex digest of ``image_bytes``
+
+        Returns:
+            Tuple of (success, full resolution AlphaMask bytes or error message)
+        """
+        try:
+            with span("seg_downscale"):
+                reduced = await asyncio.to_thread(
+                    downscale_for_segmentation, image_bytes,
+                    settings.SEGMENTATION_MAX_SIDE, settings.SEGMENTATION_DOWNSCALE_QUALITY
+                )
+        except Exception as e:
+            error_msg = f"Failed to downscale image: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        if reduced is None:
+            return await self._segment_full(image_bytes, digest)
+
+        small_bytes, size = reduced
+        logger.info(
+            f"Segmenting reduced copy of {size[0]}x{size[1]} image "
+            f"({len(small_bytes)} instead of {len(image_bytes)} bytes)"
+        )
+        success, result = await self._request_segmentation(small_bytes)
+        if not success:
+            return False, result
+        return await self._to_mask(result, digest, size)
+
+    async def _to_mask(
+        self, segmented: bytes, digest: str, size: Optional[Tuple[int, int]] = None
+    ) -> Tuple[bool, Union[bytes, str]]:
+        """Convert the backend's RGBA result to an AlphaMask, see mask_from_segmented"""
+        try:
+            with span("seg_mask"):
+                return True, await asyncio.to_thread(
+                    mask_from_segmented, segmented, digest, size, settings.SEGMENTATION_MASK_REFINE
+                )
+        except Exception as e:
+            error_msg = f"Failed to extract segmentation mask: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+    async def _post(self, backend: SegmentationBackend, body: bytes) -> Tuple[bool, Union[bytes, str], bool]:
+        """
+        Send one request to one backend and update its health statistics
+
+        Returns:
+            Tuple of (success, response body or error message, retryable)
+        """
+        self.pool.acquire(backend)
+        start = time.perf_counter()
+        try:
+            logger.info(f"Sending request to API: {backend.url}")
+            async with self._get_session().post(
+                backend.url, data=body, headers={"Content-Type": "application/json"}
+            ) as response:
+                response.raise_for_status()
+                logger.info(f"API request successful, status code: {response.status}")
+                data = await response.read()
+        except aiohttp.ClientResponseError as e:
+            error_msg = f"API request failed: {str(e)}"
+            logger.error(error_msg)
+            BACKEND_ERRORS.inc(reason="request", backend=backend.url)
+            # 4xx means the request itself was rejected; another backend won't help
+            if e.status < 500:
+                return False, error_msg, False
+            self.pool.record_failure(backend)
+            return False, error_msg, True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_msg = f"API request failed: {str(e) or type(e).__name__}"
+            logger.error(error_msg)
+            BACKEND_ERRORS.inc(reason="request", backend=backend.url)
+            self.pool.record_failure(backend)
+            return False, error_msg, True
+        finally:
+            self.pool.release(backend)
+        self.pool.record_success(backend, time.perf_counter() - start)
+        return True, data, False
+
+    async def _hedged_post(
+        self,
+        backend: SegmentationBackend,
+        body: bytes,
+        tried: List[SegmentationBackend]
+    ) -> Tuple[bool, Union[bytes, str], bool]:
+        """
+        Send a request, hedging it to a second backend if it is slow
+
+        When the first request has not finished after the pool's hedge delay
+        (a latency percentile), the same request goes to another backend and
+        whichever succeeds first wins; the other is cancelled.
+        """
+        pending = {asyncio.create_task(self._post(backend, body))}
+        try:
+            delay = self.pool.hedge_delay()
+            if delay is not None:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                hedge = self.pool.choose(exclude=tried) if not done else None
+                if hedge is not None:
+                    logger.info(f"Hedging segmentation request to {hedge.url}")
+                    HEDGED_REQUESTS.inc()
+                    tried.append(hedge)
+                    pending.add(asyncio.create_task(self._post(hedge, body)))
+                pending |= done
+            result = (False, "No segmentation backend available", True)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result[0]:
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _request_segmentation(self, image_bytes: bytes) -> Tuple[bool, Union[bytes, str]]:
+        """
+        Send image bytes to a segmentation backend and decode the reply
+
+        Failed requests are retried on other backends, up to
+        SEGMENTATION_MAX_ATTEMPTS backends in total.
+
+        Args:
+            image_bytes: Encoded input image
+
+        Returns:
+            Tuple of (success, segmented RGBA PNG bytes or error message)
+        """
+        # Prepare API request
+        # The JSON body is written around the encoded image in one buffer
+        # rather than through json.dumps, in a worker thread as it is several MB
+        with span("seg_encode"):
+            body = await asyncio.to_thread(
+                encode_base64,
+                image_bytes,
+                b'{"image_base64": "',
+                b'", "output_path": ""}'  # output_path is required by server
+            )
+
+        # Send request to API
+        tried: List[SegmentationBackend] = []
+        success, result = False, "No segmentation backend available"
+        with span("seg_request"):
+            while len(tried) < settings.SEGMENTATION_MAX_ATTEMPTS:
+                backend = self.pool.choose(exclude=tried)
+                if backend is None:
+                    break
+                tried.append(backend)
+                success, result, retryable = await self._hedged_post(backend, body, tried)
+                if success or not retryable:
+                    break
+        if not success:
+            if not tried:
+                logger.error(result)
+                BACKEND_ERRORS.inc(reason="unavailable")
+            return False, result
+        body = result
+
+        # Process API response (a multi-MB body) off the event loop
+        with span("seg_parse"):
+            success, b64_result = await asyncio.to_thread(self._parse_response, body)
+        if not success:
+            BACKEND_ERRORS.inc(reason="response")
+            return False, b64_result
+
+        # Decode base64 response
+        with span("seg_decode"):
+            return await asyncio.to_thread(self._decode_base64_response, b64_result)
+
+    async def segment_image(
         self, 
         image_path: str, 
-        output_name: Optional[str] = None
+        output_name: Optional[str] = None,
+        engine: Optional[str] = None
     ) -> Tuple[bool, str]:
         """
         Process image through segmentation API
@@ -96,9 +506,10 @@ class SegmentationService:
         Args:
             image_path: Path to input image
             output_name: Optional name for output file
+            engine: Segmentation engine, see segment_bytes
             
         Returns:
-            Tuple of (success, result)
+            Tuple of (success, path of the saved alpha mask or error message)
         """
         logger.info(f"Starting image processing: {image_path}")
 
@@ -108,48 +519,13 @@ class SegmentationService:
             logger.error(error_msg)
             return False, error_msg
 
-        # Encode image to base64
-        success, result = self._encode_image_to_base64(image_path)
+        # Read input image
+        with span("read"):
+            success, result = await asyncio.to_thread(self._read_image_bytes, image_path)
         if not success:
             return False, result
-        image_b64 = result
-
-        # Prepare API request
-        payload = {
-            "image_base64": image_b64,
-            "output_path": ""  # Required by server
-        }
 
-        # Send request to API
-        try:
-            logger.info(f"Sending request to API: {self.api_url}")
-            response = requests.post(
-                self.api_url, 
-                json=payload, 
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            logger.info(f"API request successful, status code: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            error_msg = f"API request failed: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
-
-        # Process API response
-        try:
-            data = response.json()
-            b64_result = data.get("result_base64")
-            if not b64_result:
-                error_msg = "result_base64 field not found in response"
-                logger.error(error_msg)
-                return False, error_msg
-        except Exception as e:
-            error_msg = f"Failed to process API response: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
-
-        # Decode base64 response
-        success, result = self._decode_base64_response(b64_result)
+        success, result = await self.segment_bytes(result, engine)
         if not success:
             return False, result
         image_bytes = result
@@ -157,26 +533,30 @@ class SegmentationService:
         # Prepare output path
         if not output_name:
             name = os.path.splitext(os.path.basename(image_path))[0]
-            output_name = f"{name}_segmented.png"
+            output_name = f"{name}_segmented{MASK_EXTENSION}"
         output_path = os.path.join(settings.OUTPUT_DIR, output_name)
 
         # Save processed image
-        return self._save_processed_image(image_bytes, output_path)
+        with span("persist"):
+            return await asyncio.to_thread(self._save_processed_image, image_bytes, output_path)
 
-def main():
+async def main():
     """Example usage of SegmentationService"""
     service = SegmentationService()
     
     # Test configuration
     test_config = {
         "image_path": os.path.join(project_root, "input-images", "tt18.jpg"),
-        "output_name": "tt18_segmented.png"
+        "output_name": f"tt18_segmented{MASK_EXTENSION}"
     }
     
-    success, result = service.segment_image(
-        image_path=test_config["image_path"],
-        output_name=test_config["output_name"]
-    )
+    try:
+        success, result = await service.segment_image(
+            image_path=test_config["image_path"],
+            output_name=test_config["output_name"]
+        )
+    finally:
+        await service.close()
     
     if success:
         logger.info(f"Image processing completed successfully: {result}")
@@ -189,4 +569,4 @@ if __name__ == "__main__":
         level=settings.LOG_LEVEL,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,110 @@
+import time
+import zlib
+import struct
+from io import BytesIO
+from typing import Dict, Iterator, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+from app.utils.encoding import encode_image, save_options
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def iter_strips(
+    subject: Image.Image,
+    background_color: Tuple[int, int, int],
+    size: Tuple[int, int],
+    rows: int
+) -> Iterator[Image.Image]:
+    """
+    Yield the composited canvas as RGB strips of ``rows`` rows, top to bottom.
+
+    The subject is centered as in BackgroundProcessor.compose; only the
+    current strip is ever allocated, so memory does not grow with the
+    canvas height.
+
+    Args:
+        subject: RGBA subject image
+        background_color: RGB background color tuple
+        size: Canvas dimensions (width, height)
+        rows: Strip height in pixels
+    """
+    width, height = size
+    x = (width - subject.width) // 2
+    y = (height - subject.height) // 2
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        strip = Image.new("RGB", (width, bottom - top), background_color)
+        # Rows of the subject that fall into this strip
+        src_top, src_bottom = max(top - y, 0), min(bottom - y, subject.height)
+        if src_top < src_bottom:
+            piece = subject.crop((0, src_top, subject.width, src_bottom))
+            strip.paste(piece, (x, y + src_top - top), piece)
+        yield strip
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def encode_png_strips(strips: Iterator[Image.Image], size: Tuple[int, int], compress_level: int = 6) -> bytes:
+    """
+    Encode RGB strips as one PNG without assembling the full image.
+
+    Rows use the PNG "Sub" filter and are fed to a single zlib stream as
+    they arrive.
+    """
+    width, height = size
+    out = BytesIO()
+    out.write(PNG_SIGNATURE)
+    out.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    compressor = zlib.compressobj(compress_level)
+    for strip in strips:
+        pixels = np.frombuffer(strip.tobytes(), dtype=np.uint8).reshape(strip.height, width * 3)
+        filtered = np.empty((strip.height, width * 3 + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # Sub: each byte minus the byte one pixel to the left
+        filtered[:, 1:4] = pixels[:, :3]
+        np.subtract(pixels[:, 3:], pixels[:, :-3], out=filtered[:, 4:])
+        data = compressor.compress(filtered.tobytes())
+        if data:
+            out.write(_chunk(b"IDAT", data))
+    out.write(_chunk(b"IDAT", compressor.flush()))
+    out.write(_chunk(b"IEND", b""))
+    return out.getvalue()
+
+
+def render_tiled(
+    subject: Image.Image,
+    background_color: Tuple[int, int, int],
+    size: Tuple[int, int],
+    output_format: str,
+    encode_options: Optional[Dict] = None,
+    rows: int = 256
+) -> Tuple[bytes, float]:
+    """
+    Composite and encode a large canvas strip by strip.
+
+    PNG output is streamed to the encoder one strip at a time. Other
+    encoders need the whole image, so the strips are assembled into a
+    single RGB canvas, which still avoids the RGBA canvas and the copy
+    made by whole-canvas compositing.
+
+    Returns:
+        Tuple of (encoded bytes, seconds spent compositing and encoding)
+    """
+    output_format = output_format.upper()
+    start = time.perf_counter()
+    strips = iter_strips(subject, background_color, size, rows)
+    if output_format == "PNG":
+        options = save_options("PNG", **(encode_options or {}))
+        level = 9 if options.get("optimize") else options.get("compress_level", 6)
+        return encode_png_strips(strips, size, level), time.perf_counter() - start
+
+    canvas = Image.new("RGB", size)
+    top = 0
+    for strip in strips:
+        canvas.paste(strip, (0, top))
+        top += strip.height
+    data, _ = encode_image(canvas, output_format, encode_options)
+    return data, time.perf_counter() - start
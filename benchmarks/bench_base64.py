@@ -0,0 +1,131 @@
+"""
+Memory and time of the base64 hops, before and after the streaming codec.
+
+Each hop of a /process/base64 request is run the old way (str split,
+base64.b64decode/b64encode, json) and through app.utils.base64_stream, and
+tracemalloc reports the peak allocated on top of the hop's input and
+output. It is shown as a multiple of the decoded image size.
+
+    request decode    data URL str from the request model -> image bytes
+    backend encode    image bytes -> JSON body for the segmentation API
+    backend decode    segmentation API response body -> image bytes
+    response encode   image bytes -> data URL str for the JSON response
+
+With --check the script exits non-zero if a streaming hop allocates more
+than the chunks it works on (the response encode: one encoded-size buffer),
+so it can guard against regressions.
+
+Usage:
+    python benchmarks/bench_base64.py [--size-mb 15] [--repeat 5] [--check]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import statistics
+import tracemalloc
+
+# Add project root to Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from app.utils.base64_stream import (
+    DECODE_CHUNK, ENCODE_CHUNK, decode_base64, encode_base64, encode_data_url, json_string_field
+)
+
+MIME_TYPE = "image/png"
+
+
+def old_request_decode(image_base64):
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    return base64.b64decode(image_base64)
+
+
+def old_backend_encode(image_bytes):
+    return json.dumps({
+        "image_base64": base64.b64encode(image_bytes).decode("ascii"),
+        "output_path": ""
+    }).encode("ascii")
+
+
+def old_backend_decode(body):
+    b64_result = json.loads(body).get("result_base64")
+    if ',' in b64_result:
+        b64_result = b64_result.split(',', 1)[1]
+    return base64.b64decode(b64_result)
+
+
+def old_response_encode(image_bytes):
+    return f"data:{MIME_TYPE};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+def new_backend_encode(image_bytes):
+    return encode_base64(image_bytes, b'{"image_base64": "', b'", "output_path": ""}')
+
+
+def new_backend_decode(body):
+    return decode_base64(json_string_field(body, "result_base64"))
+
+
+def measure(fn, argument, repeat: int):
+    """(median seconds, peak bytes allocated beyond the returned value)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(argument)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = fn(argument)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return statistics.median(timings), peak - current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=15.0, help="decoded image size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="fail if a streaming hop allocates a full-size copy")
+    args = parser.parse_args()
+
+    image = os.urandom(int(args.size_mb * 1024 * 1024))
+    data_url = f"data:{MIME_TYPE};base64,{base64.b64encode(image).decode('ascii')}"
+    response_body = json.dumps({"result_base64": data_url}).encode("ascii")
+
+    hops = [
+        ("request decode", old_request_decode, decode_base64, data_url, 3 * DECODE_CHUNK),
+        ("backend encode", old_backend_encode, new_backend_encode, image, 4 * ENCODE_CHUNK),
+        ("backend decode", old_backend_decode, new_backend_decode, response_body, 3 * DECODE_CHUNK),
+        # A str cannot be filled in place: one buffer of the encoded size is
+        # converted to it, instead of two with b64encode and an f-string
+        ("response encode", old_response_encode, lambda data: encode_data_url(data, MIME_TYPE), image,
+         len(data_url)),
+    ]
+    # Chunked hops may hold the previous chunk's output while the next chunk
+    # is sliced and converted; a full-size copy is far more than that
+    slack = 64 * 1024
+
+    print(f"{len(image) / 1024 / 1024:.1f}MB image, peak extra allocation as a multiple of it\n")
+    print(f"{'hop':<18}{'old ms':>10}{'new ms':>10}{'old extra':>12}{'new extra':>12}")
+    failures = []
+    for name, old, new, argument, allowance in hops:
+        assert new(argument) == old(argument), name
+        old_seconds, old_extra = measure(old, argument, args.repeat)
+        new_seconds, new_extra = measure(new, argument, args.repeat)
+        print(f"{name:<18}{old_seconds * 1000:>10.1f}{new_seconds * 1000:>10.1f}"
+              f"{old_extra / len(image):>11.2f}x{new_extra / len(image):>11.2f}x")
+        if new_extra > allowance + slack:
+            failures.append(f"{name}: {new_extra} bytes allocated beyond the result, allowed {allowance + slack}")
+
+    if args.check and failures:
+        print("\n" + "\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare the Pillow and NumPy compositing engines on large photos.
+
+Usage:
+    python benchmarks/bench_composite.py [--repeat 5] [--sizes 4000x3000 6000x4000]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+# Add project root to Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from app.utils.background import BackgroundProcessor, prepare_for_save
+
+
+def make_segmented_image(width: int, height: int, feather: float = 0.005) -> Image.Image:
+    """
+    Synthetic RGBA cut-out: noisy elliptical subject whose alpha edge is
+    ``feather`` (fraction of the subject radius) wide
+    """
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    yy, xx = np.ogrid[:height, :width]
+    dist = np.sqrt(((xx - width / 2) / (width * 0.4)) ** 2 + ((yy - height / 2) / (height * 0.4)) ** 2)
+    alpha = np.clip((1 - dist) / feather * 255, 0, 255).astype(np.uint8)
+    return Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+def time_call(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def compose_and_encode(processor, image, color, aspect, output_format):
+    final = processor.compose(image, color, aspect)
+    prepare_for_save(final, output_format).save(BytesIO(), format=output_format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", nargs="+", default=["4000x3000", "6000x4000"])
+    parser.add_argument("--aspect-ratio", default="9x16")
+    parser.add_argument("--batch", type=int, default=4, help="images per composite_batch call")
+    parser.add_argument("--feather", type=float, default=0.005,
+                        help="soft edge width as a fraction of the subject radius")
+    args = parser.parse_args()
+
+    processor = BackgroundProcessor()
+    aspect = tuple(int(v) for v in args.aspect_ratio.split("x"))
+    color = (255, 255, 255)
+
+    print("compose: compositing only; +jpeg: compositing and JPEG encode (Pillow defaults)")
+    print(f"{'size':>11} {'MP':>5} {'pillow s':>9} {'numpy s':>9} {'speedup':>8} {'batch s/img':>12} "
+          f"{'pillow+jpeg':>12} {'numpy+jpeg':>11} {'speedup':>8}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        image = make_segmented_image(width, height, args.feather)
+
+        processor.engine = "pillow"
+        pillow_s = time_call(lambda: processor.compose(image, color, aspect), args.repeat)
+        pillow_jpeg_s = time_call(lambda: compose_and_encode(processor, image, color, aspect, "JPEG"), args.repeat)
+        processor.engine = "numpy"
+        numpy_s = time_call(lambda: processor.compose(image, color, aspect), args.repeat)
+        numpy_jpeg_s = time_call(lambda: compose_and_encode(processor, image, color, aspect, "JPEG"), args.repeat)
+
+        target = processor.calculate_target_dimensions(image.size, aspect[0] / aspect[1])
+        batch = [image] * args.batch
+        batch_s = time_call(
+            lambda: processor.numpy_compositor.composite_batch(batch, color, target), max(1, args.repeat // 2)
+        ) / args.batch
+
+        print(f"{size:>11} {width * height / 1e6:>5.1f} {pillow_s:>9.3f} {numpy_s:>9.3f} "
+              f"{pillow_s / numpy_s:>7.2f}x {batch_s:>12.3f} "
+              f"{pillow_jpeg_s:>12.3f} {numpy_jpeg_s:>11.3f} {pillow_jpeg_s / numpy_jpeg_s:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Full-resolution decode vs reduced (JPEG DCT-scaled) decode for small outputs.
+
+For each input size and output max_size, one compositing job (the
+BackgroundProcessor.render_variants call behind /process/base64) cuts a
+JPEG photo out with its alpha mask and renders a 9:16 JPEG, once with
+REDUCED_DECODE_ENABLED off (decode in full, resize at the end) and once on
+(decode at 1/2, 1/4 or 1/8 scale, resample once to the output size). Every
+measurement runs in a fresh interpreter so peak RSS is not skewed by memory
+kept from earlier runs.
+
+    decode       size the JPEG is decoded at
+    ms           median time of the compositing job
+    peak MB      peak RSS growth while rendering
+
+Usage:
+    python benchmarks/bench_decode.py [--sizes 4000x3000 6000x4000] [--max-sizes 256 512 1024 0]
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+import tempfile
+from PIL import Image, ImageDraw
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmarks_dir)
+sys.path.append(project_root)
+
+from common import make_photo, parse_size
+from app.utils.alpha_mask import encode_mask
+from app.utils.limits import decode_target, draft_size
+
+CHILD = r"""
+import sys, time, json, statistics
+sys.path.insert(0, sys.argv[1])
+from common import RSSSampler
+from app.core.config import settings
+from app.utils.background import BackgroundProcessor
+image_path, mask_path, variant, enabled, repeat = sys.argv[2], sys.argv[3], json.loads(sys.argv[4]), sys.argv[5] == "1", int(sys.argv[6])
+settings.REDUCED_DECODE_ENABLED = enabled
+with open(image_path, "rb") as f:
+    image = f.read()
+with open(mask_path, "rb") as f:
+    mask = f.read()
+processor = BackgroundProcessor()
+timings = []
+# Sampled: ru_maxrss would include the parent's peak, kept across exec
+with RSSSampler(interval=0.001) as rss:
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processor.render_variants(image, [variant], mask)
+        timings.append(time.perf_counter() - start)
+print(json.dumps({"ms": statistics.median(timings) * 1000, "peak_mb": (rss.peak - rss.baseline) / 2 ** 20}))
+"""
+
+
+def make_mask(image: bytes, width: int, height: int) -> bytes:
+    """Elliptical subject covering most of the frame"""
+    alpha = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(alpha).ellipse((width // 7, height // 10, width * 6 // 7, height * 9 // 10), fill=255)
+    return encode_mask(alpha, hashlib.sha256(image).hexdigest())
+
+
+def run_child(image_path: str, mask_path: str, variant: dict, enabled: bool, repeat: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, benchmarks_dir, image_path, mask_path, json.dumps(variant),
+         "1" if enabled else "0", str(repeat)],
+        cwd=project_root, env=dict(os.environ, LOG_LEVEL="WARNING"),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["4000x3000", "6000x4000"])
+    parser.add_argument("--max-sizes", nargs="+", type=int, default=[256, 512, 1024, 0],
+                        help="output max_size values, 0 for no limit")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'input':<11}{'max_size':>9}{'decode':>12}{'full ms':>10}{'reduced ms':>12}{'speed-up':>10}"
+          f"{'full MB':>10}{'reduced MB':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            width, height = parse_size(size)
+            image = make_photo(width, height)
+            image_path = os.path.join(directory, "input.jpg")
+            mask_path = os.path.join(directory, "input.amask")
+            with open(image_path, "wb") as f:
+                f.write(image)
+            with open(mask_path, "wb") as f:
+                f.write(make_mask(image, width, height))
+
+            for max_size in args.max_sizes:
+                variant = {"aspect_ratio": [9, 16], "max_size": max_size or None, "output_format": "JPEG"}
+                decoded = draft_size((width, height), "JPEG", decode_target((width, height), [variant]))
+                full = run_child(image_path, mask_path, variant, False, args.repeat)
+                reduced = run_child(image_path, mask_path, variant, True, args.repeat)
+                rows.append({"input": size, "max_size": max_size, "decode": list(decoded), "full": full, "reduced": reduced})
+                print(f"{size:<11}{max_size or '-':>9}{f'{decoded[0]}x{decoded[1]}':>12}"
+                      f"{full['ms']:>10.1f}{reduced['ms']:>12.1f}{full['ms'] / reduced['ms']:>9.1f}x"
+                      f"{full['peak_mb']:>10.1f}{reduced['peak_mb']:>12.1f}", flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
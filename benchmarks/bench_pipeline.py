@@ -0,0 +1,235 @@
+"""
+End-to-end throughput and latency benchmark for the image pipeline.
+
+Starts the fake segmentation server (benchmarks/fake_segmentation.py) in a
+subprocess, points the service at it and measures three stages for every
+image size and concurrency level:
+
+    segmentation  SegmentationService.segment_bytes against the fake backend
+    compositing   background compositing and encoding in the compositing executor
+    end_to_end    HTTP requests against the FastAPI app served by uvicorn
+
+Each stage reports p50/p95/p99 latency, requests/s, the peak RSS of this
+process while the stage ran and how much RSS grew during it. The
+segmentation and output caches are disabled so every request reaches the
+backend and the compositing pool.
+
+With --backends N, N fake backends are started and the service balances
+across them; --fail-rate and --hang-rate apply to the first one only, to
+see how the balancer, circuit breaker and hedging cope with one bad
+backend.
+
+Usage:
+    python benchmarks/bench_pipeline.py --sizes 1024x768 4000x3000 --concurrency 1 8 32
+    python benchmarks/bench_pipeline.py --latency 0.3 --jitter 0.1 --json results.json
+    python benchmarks/bench_pipeline.py --backends 3 --hang-rate 0.2 --stages segmentation
+    python benchmarks/bench_pipeline.py --max-side 1024 --stages segmentation end_to_end
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import aiohttp
+
+# Add project root to Python path
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmarks_dir)
+sys.path.append(project_root)
+
+from common import StageResult, make_photo, parse_size, print_header, print_row, run_concurrent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 15.0) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError(f"Timed out waiting for {url}")
+            time.sleep(0.1)
+
+
+def start_fake_backend(port: int, latency: float, jitter: float, fail_rate: float = 0.0,
+                       hang_rate: float = 0.0) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, os.path.join(benchmarks_dir, "fake_segmentation.py"),
+        "--port", str(port), "--latency", str(latency), "--jitter", str(jitter),
+        "--fail-rate", str(fail_rate), "--hang-rate", str(hang_rate)
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(f"http://127.0.0.1:{port}/health")
+    return process
+
+
+class AppServer:
+    """Run the FastAPI app with uvicorn on a background thread"""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "AppServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def bench_segmentation(service, image: bytes, count: int, concurrency: int, size: str) -> StageResult:
+    result = StageResult("segmentation", size, concurrency)
+
+    async def call(_):
+        success, data = await service.segment_bytes(image)
+        if not success:
+            raise RuntimeError(data)
+
+    await run_concurrent(call, count, concurrency, result)
+    return result
+
+
+async def bench_compositing(service, image: bytes, mask: bytes, count: int, concurrency: int,
+                            size: str) -> StageResult:
+    # Imported lazily: settings must be configured before app modules load
+    from app.utils.background import render_background
+
+    result = StageResult("compositing", size, concurrency)
+
+    async def call(_):
+        await service._run_compositing(
+            render_background, image, (255, 255, 255), (9, 16), output_format="PNG", mask=mask
+        )
+
+    await run_concurrent(call, count, concurrency, result)
+    return result
+
+
+async def bench_end_to_end(base_url: str, route: str, image: bytes, count: int, concurrency: int,
+                           size: str) -> StageResult:
+    result = StageResult("end_to_end", size, concurrency)
+    payload = {"image_base64": base64.b64encode(image).decode("ascii"), "aspect_ratio": [9, 16]}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def call(_):
+            if route == "raw":
+                request = session.post(f"{base_url}/api/process/raw?aspect_ratio=9,16", data=image)
+            else:
+                request = session.post(f"{base_url}/api/process/base64", json=payload)
+            async with request as response:
+                await response.read()
+                response.raise_for_status()
+
+        await run_concurrent(call, count, concurrency, result)
+    return result
+
+
+async def run(args, service) -> list:
+    rows = []
+    print_header()
+    for size in args.sizes:
+        width, height = parse_size(size)
+        image = make_photo(width, height)
+        success, segmented = await service.segmentation_service.segment_bytes(image)
+        if not success:
+            raise RuntimeError(f"Fake backend failed: {segmented}")
+
+        for concurrency in args.concurrency:
+            count = max(args.requests, concurrency)
+            for stage in args.stages:
+                if stage == "segmentation":
+                    result = await bench_segmentation(service.segmentation_service, image, count, concurrency, size)
+                elif stage == "compositing":
+                    result = await bench_compositing(service, image, segmented, count, concurrency, size)
+                else:
+                    result = await bench_end_to_end(args.base_url, args.route, image, count, concurrency, size)
+                rows.append(result.summary())
+                print_row(rows[-1])
+    print(json.dumps(service.segmentation_service.pool.snapshot(), indent=2))
+    await service.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "3000x4000"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=32, help="requests per stage and concurrency level")
+    parser.add_argument("--stages", nargs="+", default=["segmentation", "compositing", "end_to_end"],
+                        choices=["segmentation", "compositing", "end_to_end"])
+    parser.add_argument("--route", choices=["base64", "raw"], default="base64")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake backend latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--backends", type=int, default=1, help="number of fake backends to start")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="failure rate of the first fake backend")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="hang rate of the first fake backend")
+    parser.add_argument("--request-timeout", type=int, help="segmentation API_TIMEOUT in seconds")
+    parser.add_argument("--max-side", type=int, default=0,
+                        help="send a copy reduced to this size to the backend (SEGMENTATION_MAX_SIDE)")
+    parser.add_argument("--backend-url", help="use this segmentation API instead of starting the fake one")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    backends = []
+    if args.backend_url:
+        backend_urls = [args.backend_url]
+    else:
+        backend_urls = []
+        for i in range(args.backends):
+            port = free_port()
+            fail_rate, hang_rate = (args.fail_rate, args.hang_rate) if i == 0 else (0.0, 0.0)
+            backends.append(start_fake_backend(port, args.latency, args.jitter, fail_rate, hang_rate))
+            backend_urls.append(f"http://127.0.0.1:{port}/api/segmentation/base64")
+
+    # Settings are read at import time, so configure them before importing the app
+    os.environ["SEGMENTATION_API_URL"] = backend_urls[0]
+    os.environ["SEGMENTATION_API_URLS"] = json.dumps(backend_urls)
+    os.environ["SEGMENTATION_CACHE_ENABLED"] = "false"
+    # end_to_end re-posts the same image; measure the pipeline, not output cache hits
+    os.environ["OUTPUT_CACHE_ENABLED"] = "false"
+    os.environ["SEGMENTATION_MAX_SIDE"] = str(args.max_side)
+    if args.request_timeout:
+        os.environ["API_TIMEOUT"] = str(args.request_timeout)
+    os.environ.setdefault("OUTPUT_DIR", tempfile.mkdtemp(prefix="bench-output-"))
+
+    try:
+        from app.main import app
+        from app.services.image_service import ImageService
+
+        with AppServer(app, free_port()) as server:
+            args.base_url = f"http://127.0.0.1:{server.port}"
+            rows = asyncio.run(run(args, ImageService()))
+    finally:
+        for backend in backends:
+            backend.terminate()
+            backend.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "base_url"}, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
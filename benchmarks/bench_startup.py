@@ -0,0 +1,139 @@
+"""
+Cold-start benchmark: import time, start-up and time to ready.
+
+Each run starts a fresh interpreter that imports app.main, enters the
+FastAPI lifespan, waits for /ready (warm-up finished) and then times two
+requests through ImageService against the fake segmentation server. Runs
+are repeated with warm-up enabled and disabled to show what it saves on the
+first request. Segmentation and output caches are disabled so both requests
+do the full work.
+
+    import        import app.main
+    startup       lifespan start-up (until the app would accept requests)
+    ready         lifespan start until warm-up finished
+    first         first request after ready
+    second        second request, for comparison
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --importtime 15
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmarks_dir)
+
+from bench_pipeline import free_port, start_fake_backend
+from common import make_photo
+
+CHILD = r"""
+import sys, time, json, asyncio
+start = time.perf_counter()
+import app.main as main
+imported = time.perf_counter() - start
+with open(sys.argv[1], "rb") as f:
+    image = f.read()
+
+async def run():
+    start = time.perf_counter()
+    async with main.lifespan(main.app):
+        startup = time.perf_counter() - start
+        while not main.image_service.ready:
+            await asyncio.sleep(0.001)
+        ready = time.perf_counter() - start
+        timings = []
+        for _ in range(2):
+            t = time.perf_counter()
+            await main.image_service.process_image_bytes(image)
+            timings.append(time.perf_counter() - t)
+    return startup, ready, timings
+
+startup, ready, (first, second) = asyncio.run(run())
+print(json.dumps({"import": imported, "startup": startup, "ready": ready, "first": first, "second": second}))
+"""
+
+COLUMNS = ("import", "startup", "ready", "first", "second")
+
+
+def run_child(image_path: str, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, image_path], cwd=project_root, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(top: int) -> list:
+    """Slowest modules by cumulative import time under ``python -X importtime``"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=project_root,
+        capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:   self_us | cumulative_us | <indent>module"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[1:top + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--size", default="1024x768", help="request image size")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake backend latency in seconds")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="also list the N slowest imports of app.main")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    image = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+    image.write(make_photo(width, height))
+    image.close()
+
+    port = free_port()
+    backend = start_fake_backend(port, args.latency, 0.0)
+    base_env = dict(
+        os.environ,
+        SEGMENTATION_API_URL=f"http://127.0.0.1:{port}/api/segmentation/base64",
+        SEGMENTATION_CACHE_ENABLED="false",
+        OUTPUT_CACHE_ENABLED="false",
+        OUTPUT_DIR=os.environ.get("OUTPUT_DIR", tempfile.mkdtemp(prefix="bench-output-")),
+        LOG_LEVEL="WARNING",
+    )
+    results = {}
+    try:
+        print(f"{'warm-up':<8}" + "".join(f"{c + ' ms':>12}" for c in COLUMNS))
+        for warm_up in (True, False):
+            env = dict(base_env, WARM_UP_ENABLED=str(warm_up).lower())
+            runs = [run_child(image.name, env) for _ in range(args.runs)]
+            medians = {c: statistics.median(r[c] for r in runs) for c in COLUMNS}
+            results["on" if warm_up else "off"] = {"median": medians, "runs": runs}
+            print(f"{'on' if warm_up else 'off':<8}" + "".join(f"{medians[c] * 1000:>12.1f}" for c in COLUMNS))
+    finally:
+        backend.terminate()
+        backend.wait()
+        os.unlink(image.name)
+
+    if args.importtime:
+        print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative, own, name in import_profile(args.importtime):
+            print(f"{cumulative / 1000:>14.1f}{own / 1000:>10.1f}  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
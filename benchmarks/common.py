@@ -0,0 +1,156 @@
+"""Shared helpers for the benchmark scripts"""
+import io
+import os
+import math
+import time
+import asyncio
+import resource
+import threading
+import numpy as np
+from typing import Dict, List, Sequence
+from PIL import Image
+
+
+def make_photo(width: int, height: int, quality: int = 90, seed: int = 0) -> bytes:
+    """Synthetic JPEG "product photo": a smooth subject on a light backdrop"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    base = np.stack([xx / width * 255, yy / height * 255, np.full_like(xx, 128)], axis=-1)
+    noise = rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def parse_size(value: str):
+    width, height = (int(v) for v in value.lower().split("x"))
+    return width, height
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No /proc (macOS, ...): fall back to the lifetime peak
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+class RSSSampler:
+    """Context manager recording the peak RSS seen while the block runs"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class StageResult:
+    """Latencies, wall time, errors and memory for one benchmark stage"""
+
+    def __init__(self, stage: str, size: str, concurrency: int):
+        self.stage = stage
+        self.size = size
+        self.concurrency = concurrency
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.wall = 0.0
+        self.peak_rss = 0
+        self.rss_growth = 0
+
+    def summary(self) -> Dict[str, float]:
+        done = len(self.latencies)
+        return {
+            "stage": self.stage,
+            "size": self.size,
+            "concurrency": self.concurrency,
+            "requests": done + self.errors,
+            "errors": self.errors,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "rps": done / self.wall if self.wall else 0.0,
+            "peak_rss_mb": self.peak_rss / 2 ** 20,
+            "rss_growth_mb": self.rss_growth / 2 ** 20,
+        }
+
+
+# (key, title, width, number format)
+TABLE_COLUMNS = [
+    ("stage", "stage", -12, ""),
+    ("size", "size", 10, ""),
+    ("concurrency", "conc", 5, ""),
+    ("requests", "reqs", 5, ""),
+    ("errors", "err", 4, ""),
+    ("p50_ms", "p50 ms", 9, ".1f"),
+    ("p95_ms", "p95 ms", 9, ".1f"),
+    ("p99_ms", "p99 ms", 9, ".1f"),
+    ("rps", "req/s", 8, ".2f"),
+    ("peak_rss_mb", "peak MB", 9, ".1f"),
+    ("rss_growth_mb", "grow MB", 9, ".1f"),
+]
+
+
+def _cell(value, width: int, spec: str = "") -> str:
+    text = format(value, spec)
+    return text.ljust(-width) if width < 0 else text.rjust(width)
+
+
+def print_header() -> None:
+    print(" ".join(_cell(title, width) for _, title, width, _ in TABLE_COLUMNS))
+
+
+def print_row(row: Dict[str, float]) -> None:
+    print(" ".join(_cell(row[key], width, spec) for key, _, width, spec in TABLE_COLUMNS), flush=True)
+
+
+async def run_concurrent(fn, count: int, concurrency: int, result: StageResult) -> None:
+    """Call the coroutine function ``fn(i)`` ``count`` times, ``concurrency`` at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await fn(i)
+            except Exception:
+                result.errors += 1
+            else:
+                result.latencies.append(time.perf_counter() - start)
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        result.wall = time.perf_counter() - start
+    result.peak_rss = rss.peak
+    result.rss_growth = rss.peak - rss.baseline
@@ -0,0 +1,102 @@
+"""
+Local stand-in for the segmentation API.
+
+Implements the ``POST /api/segmentation/base64`` contract: takes
+``{"image_base64": ...}`` and answers ``{"result_base64": "data:image/png;base64,..."}``
+with the input image plus an elliptical alpha mask. Latency, jitter,
+failure rate and the rate of requests that never get an answer are
+configurable.
+
+Usage:
+    python benchmarks/fake_segmentation.py --port 51055 --latency 0.2 --jitter 0.05
+"""
+import io
+import base64
+import random
+import asyncio
+import argparse
+from aiohttp import web
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def segment(image_bytes: bytes) -> bytes:
+    """Return an RGBA PNG with a soft elliptical subject mask"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert("RGBA")
+    width, height = image.size
+    mask = Image.new("L", image.size, 0)
+    ImageDraw.Draw(mask).ellipse((width * 0.1, height * 0.1, width * 0.9, height * 0.9), fill=255)
+    image.putalpha(mask.filter(ImageFilter.BoxBlur(2)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def create_app(latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0,
+               hang_rate: float = 0.0) -> web.Application:
+    """
+    Build the fake segmentation application.
+
+    Args:
+        latency: Mean added response delay in seconds
+        jitter: Uniform +/- jitter applied to the delay in seconds
+        fail_rate: Probability of answering 500 instead of a result
+        hang_rate: Probability of never answering (until the client gives up)
+    """
+    stats = {"requests": 0, "failures": 0, "hangs": 0}
+
+    async def segmentation(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        data = await request.json()
+        delay = max(0.0, latency + random.uniform(-jitter, jitter))
+        if hang_rate and random.random() < hang_rate:
+            stats["hangs"] += 1
+            await asyncio.sleep(3600)
+        if delay:
+            await asyncio.sleep(delay)
+        if fail_rate and random.random() < fail_rate:
+            stats["failures"] += 1
+            return web.json_response({"error": "injected failure"}, status=500)
+        image_b64 = data["image_base64"]
+        if "," in image_b64:
+            image_b64 = image_b64.split(",", 1)[1]
+        result = await asyncio.to_thread(segment, base64.b64decode(image_b64))
+        return web.json_response({
+            "result_base64": "data:image/png;base64," + base64.b64encode(result).decode("ascii")
+        })
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", **stats})
+
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_post("/api/segmentation/base64", segmentation)
+    app.router.add_get("/health", health)
+    return app
+
+
+async def start_server(port: int, host: str = "127.0.0.1", **kwargs) -> web.AppRunner:
+    """Start the fake server on the running loop; call ``runner.cleanup()`` to stop it"""
+    runner = web.AppRunner(create_app(**kwargs))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=51055)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.latency, args.jitter, args.fail_rate, args.hang_rate),
+        host=args.host,
+        port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
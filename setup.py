@@ -5,8 +5,9 @@ setup(
     version="0.1",
     packages=find_packages(),
     install_requires=[
-        "requests",
+        "aiohttp",
         "pydantic-settings",
         "Pillow",
+        "numpy",
     ],
 ) 
\ No newline at end of file